@@ -5,19 +5,34 @@ from PIL import Image
 from pyalup.Device import Device 
 import logging
 import time
+import os
+import sys
+import atexit
+import threading
+import argparse
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 from lightshow.arrangement import Arrangement
-
-import cProfile
+from lightshow.sampler import Sampler
+from lightshow.palette import RGBArrayToInt
+from lightshow.profiling import profiler
 
 
 logging.basicConfig()
 #logging.basicConfig(level=logging.DEBUG)
 
+parser = argparse.ArgumentParser(prog="Ambilight", description="Mirror the screen colors to ALUP LED receivers")
+parser.add_argument('--profile', default=None, help="Measure the time spent in capture, cvtColor, resize, sample, encode and send and save it to this file when done. Files ending with .json get a Chrome trace, others a text summary. Use - to print the summary")
+parser.add_argument('--cprofile', action='store_true', help="Additionally run cProfile. Only used with --profile")
+
 def main():
+    args = parser.parse_args()
+    if args.profile is not None:
+        profiler.Enable(args.cprofile)
+        atexit.register(profiler.Save, args.profile)
+
     arrangement = Arrangement()
     #arrangement.FromBitmap("./arrangements/zigzag.bmp")
     arrangement.Linear(19, height=10)
@@ -26,99 +41,203 @@ def main():
     #device.SerialConnect(port="COM6", baud=115200)
     device.SerialConnect(port="COM6", baud=250000)
 
+    # NOTE: to drive multiple devices from one screen capture, pass lists of devices, arrangements and
+    # screen regions, eg: Ambilight([tv, desk], [tv_arrangement, desk_arrangement], region=[None, (0, 0.8, 1, 0.2)])
     ambilight = Ambilight(device, arrangement)
     ambilight.logger.setLevel(logging.INFO)
     ambilight.interpolation = cv2.INTER_AREA
+    # set to True to sample with the sparse sampling matrix of the arrangement instead of rescaling the whole screen
+    ambilight.sparse = False
 
-    #ambilight.Run()
-
-    
-    profiler = cProfile.Profile()
-    profiler.runcall(ambilight.Run)
-
-    profiler.print_stats(sort='cumtime')
+    ambilight.Run()
     
     
 
 
 class Ambilight():
-    def __init__(self, device, arrangement, monitor = 0):
+    def __init__(self, device, arrangement, monitor = 0, region = None):
         """
         Default constructor
-        @param device: List of ALUP devices to which the screen should be outputted
-        @param arrangements: List of arrangements, one for each device
+        @param device: ALUP device or list of ALUP devices to which the screen should be outputted
+        @param arrangement: arrangement or list of arrangements, one for each device
         @param monitor: the Index of the Monitor to grab. Default: 0
+        @param region: the part of the screen for each device as (x, y, width, height) in fractions of the screen size,
+                       or a list with one region (or None) for each device. Default: None (the whole screen)
         
         """
         self.logger = logging.getLogger(__name__)
         self.monitor = monitor
-        self.arrangement = arrangement
-        self.device = device
+        devices = device if isinstance(device, (list, tuple)) else [device]
+        arrangements = arrangement if isinstance(arrangement, (list, tuple)) else [arrangement] * len(devices)
+        regions = region if isinstance(region, list) else [region] * len(devices)
+        if len(arrangements) != len(devices) or len(regions) != len(devices):
+            raise ValueError(f"Got {len(devices)} device(s), {len(arrangements)} arrangement(s) and {len(regions)} region(s)")
+        self.bindings = [AmbilightBinding(d, a, r) for d, a, r in zip(devices, arrangements, regions)]
         self.interpolation = cv2.INTER_LINEAR
+        # sample the LEDs with the sparse sampling matrix of the arrangement instead of rescaling the whole screen
+        self.sparse = False
 
 
     def Run(self):
+        # the screen is captured once per tick and shared with one sending thread per device
+        screen = _SharedFrame()
+        workers = [_AmbilightWorker(binding, Sampler(binding.arrangement, binding.region, self.interpolation, self.sparse), screen) for binding in self.bindings]
+        for worker in workers:
+            worker.start()
         try:
             with mss() as sct:
                 while True:
                     start = time.time()
                     # screen grab the main monitor
-                    sct_img = np.array(sct.grab(sct.monitors[self.monitor]))
+                    with profiler.Stage("capture"):
+                        sct_img = np.array(sct.grab(sct.monitors[self.monitor]))
+
 
+                    if self.sparse:
+                        # the sampling matrix only reads the pixels it needs, so no full frame color conversion is necessary
+                        bgr_frame = sct_img
+                    else:
+                        # drop the alpha channel
+                        with profiler.Stage("cvtColor"):
+                            bgr_frame = cv2.cvtColor(sct_img, cv2.COLOR_BGRA2BGR)
 
-                    # convert color from CV2 convention to RGB
-                    rgb_frame = cv2.cvtColor(sct_img, cv2.COLOR_RGBA2RGB)
+                    # hand the frame to all devices; each one samples and sends at its own pace
+                    screen.Publish(bgr_frame)
 
-                    # get colors from frame according to arrangement
-                    colors = self._SampleFromFrame(rgb_frame, self.arrangement)
+                    # stop if a device can't be updated anymore instead of silently leaving it frozen
+                    stopped = [worker for worker in workers if not worker.is_alive()]
+                    if len(stopped) > 0:
+                        self.logger.error("Stopping Ambilight: " + ", ".join(f"device {worker.binding.device.connection} failed with {worker.error!r}" for worker in stopped))
+                        break
 
                     if (self.logger.level <= logging.INFO):
                         # show the extracted LED colors separately
-                        # convert color from CV2 convention to RGB
-                        #frame = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2BGR)
-                        masked_frame = self.arrangement.MaskFrame(rgb_frame)
-                        #cv2.imshow('screen', cv2.resize(sct_img, None, fx=0.5, fy=0.5))
-                        cv2.imshow("colors", cv2.resize(masked_frame, None, fx=25, fy = 25, interpolation = cv2.INTER_NEAREST))
-                    
-                    # send to ALUP Receiver
-                    self.device.SetColors(colors)
-                    self.device.frame.offset = 32
-                    self.device.Send()
+                        for i, worker in enumerate(workers):
+                            if worker.sampler.resized_frame is not None:
+                                cv2.imshow(f"colors {i}", cv2.resize(worker.sampler.resized_frame, None, fx=25, fy = 25, interpolation = cv2.INTER_NEAREST))
 
                     if (cv2.waitKey(1) & 0xFF) == ord('q'):
                         cv2.destroyAllWindows()
                         break
                     end = time.time()
-                    print(f"{1/(end-start)} fps ({(end-start)*1000} ms), Device RTT: {self.device.latency} ms")
+                    if self.logger.isEnabledFor(logging.DEBUG):
+                        self.logger.debug(f"{1/(end-start):.1f} fps ({(end-start)*1000:.1f} ms), " + ", ".join(f"Device {i}: {worker.fps:.1f} fps, RTT: {worker.binding.device.latency} ms" for i, worker in enumerate(workers)))
         except KeyboardInterrupt:
-            self.device.Clear()
-            self.device.Disconnect()
-            cv2.destroyAllWindows()
             print("CTL+C pressed")
-
-    # sample from a frame using the given arrangement tuples (index, x, y)
-    def _SampleFromFrame(self, frame, arrangement):
-        # resize to arrangement shape
-        rgb_frame = cv2.resize(frame,arrangement.shape, interpolation=self.interpolation)
-        # extract color values
-        colors = [0 for _ in range(len(arrangement.coordinates))]
-
-        for led in arrangement.coordinates:
-            index = led[0]
-            x = led[1]
-            y = led[2]
-            # convert to hex color for ALUP
-            colors[index] = _RGBToInt(rgb_frame[y][x])
-        return colors
-
-    def _RgbToHex(self, rgb):
-        return "0x{0:02x}{1:02x}{2:02x}".format(self._clamp(rgb[0]), self._clamp(rgb[1]), self._clamp(rgb[2]))
-    def _clamp(self, x): 
-        return max(0, min(x, 255))
+        finally:
+            screen.Close()
+            for worker in workers:
+                worker.join()
+            for binding in self.bindings:
+                try:
+                    binding.device.Clear()
+                    binding.device.Disconnect()
+                except Exception as e:
+                    # keep disconnecting the other devices
+                    self.logger.warning(f"Failed to disconnect device {binding.device.connection}: {e!r}")
+            cv2.destroyAllWindows()
 
 
+class AmbilightBinding():
+    """
+    Class binding an ALUP device to an arrangement and a region of the screen
+    """
+    def __init__(self, device, arrangement, region = None, offset = 32):
+        """
+        Default constructor
+        @param device: the ALUP device
+        @param arrangement: the arrangement of the device's LEDs
+        @param region: the part of the screen as (x, y, width, height) in fractions of the screen size. Default: None (the whole screen)
+        @param offset: the offset of the first LED. Default: 32
+        """
+        self.device = device
+        self.arrangement = arrangement
+        self.region = region
+        self.offset = offset
+
+
+class _SharedFrame():
+    """
+    The latest captured screen frame, shared between the capture loop and the device threads
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._sequence = 0
+        self.closed = False
+
+    def Publish(self, frame):
+        with self._condition:
+            self._frame = frame
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def WaitForNewer(self, sequence):
+        """
+        Wait for a frame newer than the given sequence number
+        @returns: the frame and its sequence number, or (None, sequence) if closed
+        """
+        with self._condition:
+            while self._sequence <= sequence and not self.closed:
+                self._condition.wait()
+            if self.closed:
+                return None, sequence
+            return self._frame, self._sequence
+
+    def Close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class _AmbilightWorker(threading.Thread):
+    """
+    Thread sampling and sending the latest screen frame to one device.
+    Frames captured while the device is still busy are skipped, so every device runs at its own speed.
+    Failed frames are logged and skipped; the thread gives up after too many failures in a row
+    """
+    # the number of frames in a row which may fail before the worker stops
+    MAX_CONSECUTIVE_ERRORS = 10
+
+    def __init__(self, binding, sampler, screen):
+        super().__init__(daemon=True)
+        self.logger = logging.getLogger(__name__)
+        self.binding = binding
+        self.sampler = sampler
+        self.screen = screen
+        self.fps = 0.0
+        self.error = None # the error which stopped the worker, if any
+
+    def run(self):
+        sequence = 0
+        errors = 0
+        device = self.binding.device
+        while True:
+            frame, sequence = self.screen.WaitForNewer(sequence)
+            if frame is None:
+                break
+            start = time.time()
+            try:
+                colors = self.sampler.Sample(frame)
+                with profiler.Stage("encode"):
+                    colors = RGBArrayToInt(colors).tolist()
+                # send to ALUP Receiver
+                with profiler.Stage("send"):
+                    device.SetColors(colors)
+                    device.frame.offset = self.binding.offset
+                    device.Send()
+            except Exception as e:
+                errors += 1
+                self.logger.warning(f"Failed to update device {device.connection} ({errors} time(s) in a row): {e!r}")
+                if errors >= _AmbilightWorker.MAX_CONSECUTIVE_ERRORS:
+                    self.error = e
+                    self.logger.error(f"Stopping updates of device {device.connection} after {errors} failed frames")
+                    break
+                continue
+            errors = 0
+            self.fps = 1 / max(time.time() - start, 1e-6)
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
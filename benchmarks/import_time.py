@@ -0,0 +1,62 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+"""
+
+Benchmark measuring how long it takes to import the light show playback core.
+Every measurement runs in a fresh interpreter. Fails (exit code 1) if playback pulls in
+heavy modules which it doesn't need or if the import takes longer than the given budget.
+
+"""
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(SCRIPT_DIR)
+
+# modules which are only needed for video conversion, progress bars or optional features
+HEAVY_MODULES = ["cv2", "tqdm", "numpy"]
+
+# imports the playback core and reports the import time and which heavy modules got loaded
+MEASURE = f"""
+import json, sys, time
+t = time.perf_counter()
+import lightshow.lightshow
+t = time.perf_counter() - t
+print(json.dumps({{"time" : t * 1000, "loaded" : [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+def main():
+    parser = argparse.ArgumentParser(prog="Import Time Benchmark", description="Measure the import time of the light show playback core", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--runs', default=10, type=int, help="The number of measurements")
+    parser.add_argument('--budget', default=None, type=float, help="Fail if the median import time in ms exceeds this value")
+    args = parser.parse_args()
+
+    times = []
+    loaded = set()
+    for _ in range(args.runs):
+        result = subprocess.run([sys.executable, "-c", MEASURE], cwd=REPO_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr)
+            sys.exit(result.returncode)
+        measurement = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(measurement["time"])
+        loaded.update(measurement["loaded"])
+
+    median = statistics.median(times)
+    print(f"Import time of lightshow.lightshow: median {median:.1f} ms, min {min(times):.1f} ms, max {max(times):.1f} ms ({args.runs} runs)")
+
+    failed = False
+    if len(loaded) > 0:
+        print("FAIL: playback imports heavy modules: " + ", ".join(sorted(loaded)))
+        failed = True
+    if args.budget is not None and median > args.budget:
+        print(f"FAIL: median import time exceeds the budget of {args.budget} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
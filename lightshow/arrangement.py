@@ -1,5 +1,5 @@
 import logging
-import cv2
+import math
 import numpy as np
 from pathlib import Path
 
@@ -12,6 +12,8 @@ class Arrangement():
         self.shape = None # 2D shape of the arrangement (width, height)
         self.coordinates = [] # array of coordinates and led Indices: (index, x, y), not necessarily sorted
         self.name = "" # name of the arrangement; should be descriptive of how the LEDs are arranged
+        self._sampling_cache = {} # sampling matrices for each source resolution; see GetSamplingMatrix()
+        self._coordinate_array = None # coordinates as numpy array; see _CoordinateArray()
 
     def FromBitmap(self, bitmap):
         """
@@ -20,6 +22,9 @@ class Arrangement():
         White Pixels will be ignored
         @param bitmap: the bitmap to load the arrangement from
         """
+        # NOTE: cv2 is imported on first use to keep importing this module cheap
+        import cv2
+
         self.logger.info("Loading arrangement from bitmap " + str(bitmap))
         image = cv2.imread(bitmap)
 
@@ -30,6 +35,8 @@ class Arrangement():
             return
 
         self.coordinates = []
+        self._sampling_cache = {}
+        self._coordinate_array = None
 
         # convert the shape to (width, height)
         self.shape = (image.shape[1], image.shape[0])
@@ -62,6 +69,8 @@ class Arrangement():
         self.name = f"Linear ({n})"
         self.shape = (n, 1 + height)
         self.coordinates = [(i,i, height) for i in range(n,)]
+        self._sampling_cache = {}
+        self._coordinate_array = None
 
     def _FindIndex(self, index):
         """
@@ -86,20 +95,161 @@ class Arrangement():
             mask[y][x] = [255, 255, 255]
         return mask
     
-    def MaskFrame(self, frame):
+    def MaskFrame(self, frame, sparse = False):
         """
         Applies a mask according to the arrangement to the given frame
         @param frame: A cv2 Mat or Numpy array containing image data
+        @param sparse: sample the LED colors using the sampling matrix instead of rescaling the whole frame. Default: False
         @returns: the rescaled frame with only the LEDs set to color
         """
+        if sparse:
+            return self.ColorsToFrame(self.Sample(frame))
+
+        import cv2
+
         # rescale frame to arrangement resolution
         resized_frame = cv2.resize(frame, self.shape)
         # apply mask
         masked_frame = cv2.bitwise_and(resized_frame, self.GetMask())
 
         return masked_frame
+
+    def GetSamplingMatrix(self, source_shape, footprint = 1.0, kernel = "box", max_samples = 64):
+        """
+        Get the sparse sampling matrix for frames of the given resolution.
+        Matrices are built once for each resolution and parameter set and cached afterwards.
+        @param source_shape: the resolution of the frames as (width, height)
+        @param footprint: the size of the area sampled for each LED relative to one arrangement pixel. Default: 1.0
+        @param kernel: the weighting of the sampled pixels, either "box" or "gaussian". Default: "box"
+        @param max_samples: the maximum number of pixels sampled for each LED. Larger footprints are sampled on a sparser grid. Default: 64
+        @returns: a SamplingMatrix
+        """
+        key = (tuple(source_shape), footprint, kernel, max_samples)
+        matrix = self._sampling_cache.get(key)
+        if matrix is None:
+            self.logger.debug(f"Building sampling matrix for {self.name} at resolution {source_shape}")
+            matrix = SamplingMatrix(self, source_shape, footprint, kernel, max_samples)
+            self._sampling_cache[key] = matrix
+        return matrix
+
+    def Sample(self, frame, footprint = 1.0, kernel = "box", max_samples = 64):
+        """
+        Sample the LED colors from the given frame using a cached sparse sampling matrix.
+        In contrast to rescaling the frame, this only reads the pixels around each LED.
+        @param frame: A cv2 Mat or Numpy array containing image data
+        @returns: a numpy array of shape (number of LEDs, channels) with the color of each LED, ordered by LED index
+        """
+        matrix = self.GetSamplingMatrix((frame.shape[1], frame.shape[0]), footprint, kernel, max_samples)
+        return matrix.Apply(frame)
+
+    def ColorsToFrame(self, colors):
+        """
+        Create an image in the resolution of the arrangement with each LED set to its color
+        @param colors: a numpy array with the color of each LED, ordered by LED index
+        @returns: the image as numpy array
+        """
+        coordinates = self._CoordinateArray()
+        frame = np.zeros((self.shape[1], self.shape[0], colors.shape[1]), dtype=np.uint8)
+        frame[coordinates[:, 2], coordinates[:, 1]] = colors[coordinates[:, 0]]
+        return frame
+
+    def _CoordinateArray(self):
+        """
+        @returns: the coordinates as numpy array of shape (number of LEDs, 3), built once after loading the arrangement
+        """
+        if self._coordinate_array is None:
+            self._coordinate_array = np.array(self.coordinates, dtype=np.intp).reshape(-1, 3)
+        return self._coordinate_array
     
     
+class SamplingMatrix():
+    """
+    Sparse matrix mapping the pixels of frames with a fixed resolution to the colors of the LEDs of an arrangement.
+    Each LED is the weighted sum of the pixels in its footprint, so sampling a frame is one sparse matrix-vector product.
+    The matrix is stored in compressed row form: the pixel positions and weights of all LEDs are concatenated
+    and row_starts contains the first entry of each LED.
+    """
+    KERNELS = ["box", "gaussian"]
+
+    def __init__(self, arrangement, source_shape, footprint = 1.0, kernel = "box", max_samples = 64):
+        """
+        Default constructor
+        @param arrangement: the arrangement to sample
+        @param source_shape: the resolution of the frames as (width, height)
+        @param footprint: the size of the area sampled for each LED relative to one arrangement pixel. Default: 1.0
+        @param kernel: the weighting of the sampled pixels, either "box" or "gaussian". Default: "box"
+        @param max_samples: the maximum number of pixels sampled for each LED. Default: 64
+        """
+        if kernel not in SamplingMatrix.KERNELS:
+            raise ValueError("Unknown sampling kernel: " + str(kernel))
+        self.source_shape = tuple(source_shape)
+        width, height = self.source_shape
+        # size of one arrangement pixel in source pixels
+        cell_width = width / arrangement.shape[0]
+        cell_height = height / arrangement.shape[1]
+
+        leds = sorted(arrangement.coordinates)
+        self.led_indices = np.array([led[0] for led in leds], dtype=np.intp)
+        xs, ys, weights, row_starts = [], [], [], []
+        count = 0
+        for _, x, y in leds:
+            # footprint of the LED in source pixels
+            center_x = (x + 0.5) * cell_width
+            center_y = (y + 0.5) * cell_height
+            half_width = max(footprint * cell_width / 2, 0.5)
+            half_height = max(footprint * cell_height / 2, 0.5)
+            x0, x1 = _PixelRange(center_x, half_width, width)
+            y0, y1 = _PixelRange(center_y, half_height, height)
+
+            # sample large footprints on a sparser grid
+            stride = max(1, math.ceil(math.sqrt((x1 - x0) * (y1 - y0) / max_samples)))
+            grid_x, grid_y = np.meshgrid(np.arange(x0, x1, stride), np.arange(y0, y1, stride))
+            grid_x = grid_x.ravel()
+            grid_y = grid_y.ravel()
+
+            if kernel == "gaussian":
+                # standard deviation of a quarter of the footprint size (half of its half width / height)
+                w = np.exp(-(((grid_x + 0.5 - center_x) / half_width) ** 2 + ((grid_y + 0.5 - center_y) / half_height) ** 2) * 2)
+            else:
+                w = np.ones(len(grid_x))
+
+            row_starts.append(count)
+            count += len(grid_x)
+            xs.append(grid_x)
+            ys.append(grid_y)
+            weights.append(w / w.sum())
+
+        self.xs = np.concatenate(xs).astype(np.intp) if len(xs) > 0 else np.zeros(0, dtype=np.intp)
+        self.ys = np.concatenate(ys).astype(np.intp) if len(ys) > 0 else np.zeros(0, dtype=np.intp)
+        self.weights = np.concatenate(weights).astype(np.float32)[:, None] if len(weights) > 0 else np.zeros((0, 1), dtype=np.float32)
+        self.row_starts = np.array(row_starts, dtype=np.intp)
+
+    def Apply(self, frame):
+        """
+        Sample the LED colors from a frame
+        @param frame: a numpy array of shape (height, width, channels) matching the source shape of this matrix
+        @returns: a uint8 numpy array of shape (number of LEDs, channels) ordered by LED index
+        """
+        if (frame.shape[1], frame.shape[0]) != self.source_shape:
+            raise ValueError(f"Frame resolution {(frame.shape[1], frame.shape[0])} does not match sampling matrix resolution {self.source_shape}")
+        colors = np.zeros((len(self.led_indices), frame.shape[2]), dtype=np.uint8)
+        if len(self.row_starts) == 0:
+            return colors
+        # gather only the sampled pixels and sum them up per LED
+        samples = frame[self.ys, self.xs].astype(np.float32) * self.weights
+        colors[self.led_indices] = np.clip(np.rint(np.add.reduceat(samples, self.row_starts, axis=0)), 0, 255)
+        return colors
+
+
+def _PixelRange(center, half_size, size):
+    """
+    Get the range [start, end) of pixels covered by an area around center, clipped to [0, size)
+    """
+    start = min(max(int(math.floor(center - half_size)), 0), size - 1)
+    end = min(max(int(math.ceil(center + half_size)), start + 1), size)
+    return start, end
+
+
 def _RGBToInt(rgb):
     color = 0
     for c in rgb[::-1]:
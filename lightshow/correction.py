@@ -0,0 +1,58 @@
+import numpy as np
+
+class ColorCorrection():
+    """
+    Class describing the color correction profile of one LED receiver.
+    The profile is compiled to one 256-entry lookup table per channel which is applied
+    to whole frames at once right before sending them.
+    """
+    def __init__(self, gamma = 1.0, white_balance = (1.0, 1.0, 1.0), brightness = 1.0, name = None):
+        """
+        Default constructor
+        @param gamma: the gamma exponent applied to each channel. Default: 1.0
+        @param white_balance: the (red, green, blue) multipliers for each channel. Default: (1.0, 1.0, 1.0)
+        @param brightness: the global brightness multiplier. Default: 1.0
+        @param name: the name of the profile if it is shared between devices in a light show file. Default: None
+        """
+        self.name = name
+        self.gamma = float(gamma)
+        self.white_balance = tuple(float(value) for value in white_balance)
+        self.brightness = float(brightness)
+        if len(self.white_balance) != 3:
+            raise ValueError("White balance needs exactly 3 values (red, green, blue)")
+        if self.gamma <= 0:
+            raise ValueError("Gamma needs to be positive, got " + str(self.gamma))
+        self.Compile()
+
+    def Compile(self):
+        """
+        Compute the lookup tables. Needs to be called after changing the profile.
+        NOTE: the tables of each channel are already shifted to their position in a 24-bit color
+        """
+        values = (np.arange(256) / 255.0) ** self.gamma
+        self._lut = []
+        for shift, factor in zip((16, 8, 0), self.white_balance):
+            channel = np.clip(np.rint(values * 255 * factor * self.brightness), 0, 255).astype(np.uint32)
+            self._lut.append(channel << shift)
+
+    def Apply(self, colors):
+        """
+        Apply the color correction to a list of integer colors
+        @param colors: a list of 24-bit integer colors
+        @returns: a list containing the corrected colors
+        """
+        colors = np.asarray(colors, dtype=np.uint32)
+        corrected = self._lut[0][(colors >> 16) & 255] | self._lut[1][(colors >> 8) & 255] | self._lut[2][colors & 255]
+        return corrected.tolist()
+
+    def toJson(self):
+        return {"gamma" : self.gamma, "white_balance" : list(self.white_balance), "brightness" : self.brightness}
+
+    def fromJson(data, name = None):
+        """
+        Create a color correction from a json object, eg: {"gamma" : 2.2, "white_balance" : [1.0, 0.9, 0.8], "brightness" : 0.5}
+        """
+        return ColorCorrection(data.get("gamma", 1.0), data.get("white_balance", (1.0, 1.0, 1.0)), data.get("brightness", 1.0), name)
+
+    def __str__(self):
+        return f"ColorCorrection(gamma: {self.gamma}, white balance: {self.white_balance}, brightness: {self.brightness})"
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import cv2
+import numpy as np
+
+from .profiling import profiler
+
+class FrameCache():
+    """
+    Content addressed cache of decoded video frames at a reduced working resolution.
+    Each entry is keyed by the hash of the video file, the resolution and the frame rate and stores all frames
+    in one raw file which is memory mapped when reading. Least recently used entries are evicted when the
+    cache exceeds its size limit.
+    """
+    def __init__(self, directory, max_bytes = 4 * 1024**3):
+        """
+        Default constructor
+        @param directory: the directory to store the cache in. Created if it does not exist
+        @param max_bytes: the maximum total size of all cache entries. Default: 4 GiB
+        """
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def Frames(self, video_file, resolution, fps = None):
+        """
+        Iterate over the frames of a video at the given resolution, decoding it only if it is not cached yet
+        @param video_file: the path of the video file
+        @param resolution: the working resolution as (width, height)
+        @param fps: the frame rate to resample the video to. Default: None (keep all frames)
+        @returns: a generator yielding a tuple (timestamp in ms, BGR frame) for each frame
+        """
+        key = self.Key(video_file, resolution, fps)
+        entry = os.path.join(self.directory, key)
+        if os.path.isfile(os.path.join(entry, "meta.json")):
+            self.logger.info("Reading frames from cache entry " + key)
+            return self._Read(entry)
+        self.logger.info("Video not cached yet, decoding into cache entry " + key)
+        return self._Decode(video_file, resolution, fps, entry)
+
+    def Key(self, video_file, resolution, fps = None):
+        """
+        @returns: the cache key for a video file, resolution and frame rate
+        """
+        return f"{self._Hash(video_file)}_{resolution[0]}x{resolution[1]}_{fps if fps is not None else 'all'}"
+
+    def _Read(self, entry):
+        with open(os.path.join(entry, "meta.json")) as f:
+            meta = json.load(f)
+        # mark the entry as recently used
+        os.utime(os.path.join(entry, "meta.json"))
+        count = meta["count"]
+        if count == 0:
+            return
+        frames = np.memmap(os.path.join(entry, "frames.raw"), dtype=np.uint8, mode="r", shape=(count, meta["height"], meta["width"], 3))
+        timestamps = np.load(os.path.join(entry, "timestamps.npy"))
+        for i in range(count):
+            yield int(timestamps[i]), frames[i]
+        del frames
+
+    def _Decode(self, video_file, resolution, fps, entry):
+        # decode into a temporary directory first, so unfinished entries are never read
+        temporary = tempfile.mkdtemp(prefix=".tmp_", dir=self.directory)
+        cap = cv2.VideoCapture(video_file)
+        timestamps = []
+        complete = False
+        try:
+            with open(os.path.join(temporary, "frames.raw"), "wb") as raw:
+                next_timestamp = 0
+                while cap.isOpened():
+                    with profiler.Stage("decode"):
+                        ret, frame = cap.read()
+                    if not ret:
+                        complete = True
+                        break
+                    timestamp = int(cap.get(cv2.CAP_PROP_POS_MSEC))
+                    # resample to the target frame rate by dropping frames
+                    if fps is not None:
+                        if timestamp < next_timestamp:
+                            continue
+                        next_timestamp = (int(timestamp * fps / 1000) + 1) * 1000 / fps
+                    with profiler.Stage("resize"):
+                        small = cv2.resize(frame, tuple(resolution), interpolation=cv2.INTER_AREA)
+                    small.tofile(raw)
+                    timestamps.append(timestamp)
+                    yield timestamp, small
+        finally:
+            cap.release()
+            # don't cache videos which could not be decoded at all
+            if complete and len(timestamps) > 0:
+                self._Commit(temporary, entry, resolution, fps, timestamps, video_file)
+            else:
+                shutil.rmtree(temporary, ignore_errors=True)
+
+    def _Commit(self, temporary, entry, resolution, fps, timestamps, video_file):
+        np.save(os.path.join(temporary, "timestamps.npy"), np.array(timestamps, dtype=np.int64))
+        meta = {"count" : len(timestamps), "width" : resolution[0], "height" : resolution[1], "fps" : fps, "video" : os.path.basename(video_file)}
+        with open(os.path.join(temporary, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        try:
+            os.replace(temporary, entry)
+        except OSError:
+            # another process cached the same video in the meantime
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.Evict()
+
+    def Evict(self):
+        """
+        Delete least recently used entries until the cache fits into its size limit
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            meta = os.path.join(self.directory, name, "meta.json")
+            if os.path.isfile(meta):
+                entries.append((os.path.getmtime(meta), _DirectorySize(os.path.join(self.directory, name)), name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.logger.info(f"Evicting cache entry {name} ({size / 1024**2:.1f} MiB)")
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            total -= size
+
+    def _Hash(self, video_file):
+        """
+        Hash the content of a video file. Hashes are remembered by path, size and modification time
+        so unchanged files are only read once
+        """
+        stat = os.stat(video_file)
+        hashes_path = os.path.join(self.directory, "hashes.json")
+        hashes = {}
+        if os.path.isfile(hashes_path):
+            try:
+                with open(hashes_path) as f:
+                    hashes = json.load(f)
+            except ValueError:
+                hashes = {}
+        path = os.path.abspath(video_file)
+        known = hashes.get(path)
+        if known is not None and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime_ns:
+            return known["hash"]
+
+        sha = hashlib.sha256()
+        with open(video_file, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()[:32]
+
+        hashes[path] = {"size" : stat.st_size, "mtime" : stat.st_mtime_ns, "hash" : digest}
+        # write atomically; concurrent writers may drop each others entries, which only costs a rehash
+        temporary = hashes_path + f".{os.getpid()}"
+        with open(temporary, "w") as f:
+            json.dump(hashes, f)
+        os.replace(temporary, hashes_path)
+        return digest
+
+
+def _DirectorySize(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def ResolutionFromString(resolution : str):
+    """
+    Parse a resolution from a string
+    Format: [width]x[height] eg: 160x90
+    """
+    width, height = (int(value) for value in resolution.lower().split('x'))
+    if width <= 0 or height <= 0:
+        raise ValueError("Resolution needs to be positive: " + resolution)
+    return (width, height)
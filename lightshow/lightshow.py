@@ -1,9 +1,10 @@
+import bisect
 import json
 import logging
+import math
 import time
 import threading
 import uuid
-from tqdm import tqdm
 import pyalup
 from pyalup.Device import Device
 from pyalup.Frame import Frame, Command
@@ -11,6 +12,10 @@ from pyalup.SerialConnection import SerialConnection
 from pyalup.TcpConnection import TcpConnection
 
 from .util import Convert
+from .profiling import profiler
+
+# NOTE: This module is the playback core and should only import what every light show needs.
+# Optional features (progress bar, palettes, color correction) import their dependencies on first use.
 
 class Lightshow:
     def __init__(self):
@@ -18,17 +23,51 @@ class Lightshow:
         # NOTE: Don't use pyalup.Group here because we are not necessarily running devices synchronized (???)
         self.devices = []
         self.frames = [] # 2d-array with frames for each device
+        self.timestamps = [] # sorted relative time stamps of the frames for each device; see BuildIndex()
+        self.corrections = {} # color correction profile applied before sending, for each device which has one
 
         # start time of the lightshow in ms
         self.t_start = 0
         self._skip_late_frames = True
 
+        # devices which failed to connect or calibrate and can't receive frames
+        self._failed_devices = set()
+        # report of the last Connect() / Calibrate() calls
+        self.report = StartupReport()
+        # background thread reconnecting devices which failed at startup
+        self._retry_thread = None
+        self._stop_retry = threading.Event()
+        # connection attempts which timed out but are still running
+        self._pending = {}
+        # devices which are connected but failed to calibrate; retries only need to calibrate them
+        self._uncalibrated = set()
+
+        # recalibrate each device periodically during Run(). Default: None (only calibrate once)
+        self.recalibration_interval = None
+        # recalibrate a device early if the (smoothed) fraction of late frames exceeds this value. Default: None (never)
+        self.recalibration_lateness = None
+        # clock offset, drift and lateness of each device; see DeviceTelemetry
+        self.telemetry = {}
+        # locks preventing sending and recalibrating a device at the same time
+        self._device_locks = {}
+        # devices which need to be recalibrated as soon as possible because too many frames were late
+        self._recalibration_requests = set()
+
     
     
-    def Run(self, speed=1):
-        # initialize start time 
-        self.t_start = time.time_ns() // 1000000
-        self.logger.info(f"Start running lightshow at {speed}x speed")
+    def Run(self, speed=1, start=0, end=None):
+        """
+        Play the light show on all devices
+        @param speed: the playback speed multiplier. Default: 1
+        @param start: the time stamp of the light show in ms to start playing at. Default: 0
+        @param end: the time stamp of the light show in ms to stop playing at. Default: None (play until the end)
+        """
+        if self._IndexIsStale():
+            self.BuildIndex()
+
+        # initialize start time so that the show time 'start' is now
+        self.t_start = time.time_ns() // 1000000 - int(start // speed)
+        self.logger.info(f"Start running lightshow at {speed}x speed from {start} ms")
         self.logger.info("at " + str(time.strftime('%d.%m.%y %Hh:%Mm:%Ss', time.gmtime(self.t_start / 1000))))
 
 
@@ -37,116 +76,503 @@ class Lightshow:
         threads = []
         # configure one thread for each device
         for i, device in enumerate(self.devices):
-            thread = threading.Thread(target=self._RunLightshow(device, self.frames[i], speed))
+            thread = threading.Thread(target=self._RunLightshow, args=(device, self.frames[i], self.timestamps[i], speed, start, end))
             threads.append(thread)
 
         self.logger.debug(f"Registered {len(self.devices)} thread(s)")
 
+        # recalibrate clocks in the background while playing
+        stop_recalibration = threading.Event()
+        recalibration_thread = None
+        if self.recalibration_interval is not None or self.recalibration_lateness is not None:
+            recalibration_thread = threading.Thread(target=self._RecalibrationLoop, args=(stop_recalibration,), daemon=True)
+            for device in self.devices:
+                if device not in self._failed_devices and self._Telemetry(device).offset is None:
+                    self.logger.warning(f"Device {self._DeviceName(device)} does not provide its clock offset (Device.{DeviceTelemetry.OFFSET_ATTRIBUTE}); "
+                                        "recalibration will update its latency, but clock drift will not be compensated")
+
         # start all threads
         self.logger.debug("Starting threads")
         for thread in threads:
             thread.start()
+        if recalibration_thread is not None:
+            recalibration_thread.start()
 
         # wait for all threads to finish
 
         for thread in threads:
             thread.join()
 
+        if recalibration_thread is not None:
+            stop_recalibration.set()
+            recalibration_thread.join()
+            for device in self.devices:
+                if device in self.telemetry:
+                    self.logger.info(f"Device {self._DeviceName(device)}: {self.telemetry[device]}")
+
         # wait for all outstanding answers
 
         for device in self.devices:
+            if device in self._failed_devices:
+                continue
             self.logger.debug("Flushing buffer for device " + str(device.configuration.deviceName))
             device.FlushBuffer()
 
         self.logger.info("Done.")
         
 
-    def _RunLightshow(self, device, frames, speed = 1):
+    def _RunLightshow(self, device, frames, timestamps, speed = 1, start = 0, end = None):
         # calibrate time synchronization
         #self.logger.debug("Calibrating device")
         #device.Calibrate()
-        self.logger.debug(f"Playing {len(frames)} frames")
+
+        # only play the frames between start and end
+        with profiler.Stage("schedule"):
+            first = self.Seek(timestamps, start)
+            last = len(frames) if end is None else bisect.bisect_right(timestamps, end)
+        self.logger.debug(f"Playing {max(last - first, 0)} frames")
 
         # enable progress bar for log level INFO and below
+        progress = None
         if self.logger.level <= logging.INFO:
-            _frames = tqdm(frames)
-        else:
-            _frames = frames 
+            from tqdm import tqdm
+            progress = tqdm(total=max(last - first, 0))
 
         # track number of skipped frames 
         skipped_frames = 0
 
-        for frame in _frames:
+        correction = self.corrections.get(device)
+        lock = self._DeviceLock(device)
+
+        i = first
+        while i < last:
+            # wait for devices which are not (yet) connected
+            if device in self._failed_devices:
+                time.sleep(0.1)
+                late = self._SkipLateFrames(device, timestamps, speed, i, last) - i
+                skipped_frames += late
+                i += late
+                if progress is not None:
+                    progress.update(late)
+                continue
+
+            frame = frames[i]
+            telemetry = self._Telemetry(device)
             # make timestamp relative to start point in time
             # NOTE: we used a hack previously to store the relative time in the time stamp
             relative_timestamp = frame.timestamp
-            frame.timestamp = (frame.timestamp // speed) + self.t_start
+            due = (frame.timestamp // speed) + self.t_start
+            # compensate the clock drift of the device since its last calibration
+            frame.timestamp = due + round(telemetry.DriftCorrection())
 
             # ignore frame if already too late
-            self.logger.debug(f"Frame time stamp: {frame.timestamp}, now: {time.time() * 1000}, device latency: {device.latency}, Skipping frame? {frame.timestamp <= (time.time()* 1000) + device.latency//2}")
-            if(self._skip_late_frames and frame.timestamp <= (time.time() * 1000) + device.latency//2):
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(f"Frame time stamp: {frame.timestamp}, now: {time.time() * 1000}, device latency: {device.latency}, Skipping frame? {due <= (time.time()* 1000) + device.latency//2}")
+            if(self._skip_late_frames and due <= (time.time() * 1000) + device.latency//2):
                 # reset the time stamp to the relative time stamp
                 # NOTE: this only works because ALUP makes a copy of the frame before sending
                 frame.timestamp = relative_timestamp
-                skipped_frames += 1
-                self.logger.debug("Connection too slow; Skipping frame")
+                # jump directly to the first frame which can still be sent in time
+                with profiler.Stage("schedule"):
+                    late = max(self._SkipLateFrames(device, timestamps, speed, i + 1, last) - i, 1)
+                skipped_frames += late
+                i += late
+                if progress is not None:
+                    progress.update(late)
+                self._TrackLateness(device, telemetry, late, 0)
+                self.logger.debug(f"Connection too slow; Skipping {late} frame(s)")
                 continue
             
-            device.frame = frame
-            device.Send()
+            # apply the color correction of the device
+            colors = frame.colors
+            if correction is not None:
+                with profiler.Stage("correct"):
+                    frame.colors = correction.Apply(colors)
+
+            with profiler.Stage("send"), lock:
+                device.frame = frame
+                device.Send()
+            self._TrackLateness(device, telemetry, 0, 1)
             
-            self.logger.debug("Sent frame to device " + str(device.configuration.deviceName) + "\n"+ str(frame))
-            # reset the time stamp to the relative time stamp
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Sent frame to device " + str(device.configuration.deviceName) + "\n"+ str(frame))
+            # reset the time stamp and colors to the values of the light show
             # NOTE: this only works because ALUP makes a copy of the frame before sending
             frame.timestamp = relative_timestamp
-        self.logger.info(f"Device {device.configuration.deviceName} skipped {skipped_frames} frames total ({100 * skipped_frames / len(frames)}%)")
-
-    # calibrate time synchronization for all devices
-    def Calibrate(self):
-        # calibrate devices
+            frame.colors = colors
+            i += 1
+            if progress is not None:
+                progress.update(1)
+
+        if progress is not None:
+            progress.close()
+        self.logger.info(f"Device {self._DeviceName(device)} skipped {skipped_frames} frames total ({100 * skipped_frames / max(last - first, 1)}%)")
+
+    def _RecalibrationLoop(self, stop, poll_interval = 0.5):
+        """
+        Recalibrate devices in the background when their interval is over or too many of their frames are late
+        @param stop: event ending the loop
+        """
+        while not stop.wait(poll_interval):
+            for device in self.devices:
+                if device in self._failed_devices:
+                    continue
+                telemetry = self._Telemetry(device)
+                due = self.recalibration_interval is not None and time.monotonic() - telemetry.last_attempt >= self.recalibration_interval
+                if due or device in self._recalibration_requests:
+                    self._Recalibrate(device)
+
+    def _Recalibrate(self, device):
+        """
+        Measure the clock offset and latency of a device again and update its drift estimate.
+        Sending to this device waits until the calibration is done; frames which were already sent keep playing
+        """
+        self._recalibration_requests.discard(device)
+        self.logger.debug(f"Recalibrating device {self._DeviceName(device)}")
+        try:
+            with self._DeviceLock(device):
+                # wait for the acknowledgements of all sent frames, so they don't get mixed up with the calibration
+                device.FlushBuffer()
+                device.Calibrate()
+        except Exception as e:
+            self.logger.warning(f"Recalibrating device {self._DeviceName(device)} failed: {e!r}")
+            # don't retry immediately; the last successful calibration stays the reference for the drift
+            self._Telemetry(device).last_attempt = time.monotonic()
+            return
+        telemetry = self._Telemetry(device)
+        telemetry.Update(device)
+        self.logger.info(f"Recalibrated device {self._DeviceName(device)}: {telemetry}")
+
+    def _TrackLateness(self, device, telemetry, late, sent):
+        """
+        Update the lateness statistics of a device and request a recalibration if the lateness is trending upward
+        """
+        telemetry.TrackLateness(late, sent)
+        if self.recalibration_lateness is None or telemetry.late_ratio <= self.recalibration_lateness:
+            return
+        # give the last calibration (attempt) some time to take effect
+        if time.monotonic() - telemetry.last_attempt >= DeviceTelemetry.MIN_RECALIBRATION_GAP:
+            self._recalibration_requests.add(device)
+
+    def _DeviceLock(self, device):
+        lock = self._device_locks.get(device)
+        if lock is None:
+            lock = self._device_locks.setdefault(device, threading.Lock())
+        return lock
+
+    def _Telemetry(self, device):
+        telemetry = self.telemetry.get(device)
+        if telemetry is None:
+            telemetry = self.telemetry.setdefault(device, DeviceTelemetry(device))
+        return telemetry
+
+    def BuildIndex(self):
+        """
+        Sort the frames of each device by their time stamp and build the time stamp index used for seeking.
+        Needs to be called after modifying self.frames; Run() does this automatically if the number of frames changed
+        """
+        self.timestamps = []
+        for i in range(len(self.frames)):
+            # NOTE: the sort is stable, so frames with equal time stamps keep their order
+            self.frames[i].sort(key=lambda frame: frame.timestamp)
+            self.timestamps.append([frame.timestamp for frame in self.frames[i]])
+
+    def Seek(self, timestamps, t):
+        """
+        Find the first frame at or after the given time
+        @param timestamps: the sorted relative time stamps of one device
+        @param t: the relative time stamp in ms
+        @returns: the index of the first frame with a time stamp >= t
+        """
+        return bisect.bisect_left(timestamps, t)
+
+    def _SkipLateFrames(self, device, timestamps, speed, lo, hi):
+        """
+        Find the first frame in [lo, hi) which can still be sent to the device in time
+        """
+        # a frame is late if (timestamp // speed) + t_start <= now + latency // 2
+        threshold = (time.time() * 1000) + device.latency // 2 - self.t_start
+        return bisect.bisect_left(timestamps, (math.floor(threshold) + 1) * speed, lo, max(lo, hi))
+
+    def _IndexIsStale(self):
+        if len(self.timestamps) != len(self.frames):
+            return True
+        return any(len(timestamps) != len(frames) for timestamps, frames in zip(self.timestamps, self.frames))
+
+    def Connect(self, timeout = None, allow_partial = False, retry_interval = 5):
+        """
+        Connect to all devices concurrently
+        @param timeout: the maximum time in seconds to wait for each device. Default: None (wait forever)
+        @param allow_partial: if True, continue with the devices which could be connected and keep
+                              retrying the failed ones in the background. Otherwise, raise a ConnectionError
+                              if any device fails. Default: False
+        @param retry_interval: the time in seconds between reconnection attempts for failed devices. Default: 5
+        @returns: the StartupReport for all devices
+        """
+        self.logger.info("Connecting to devices...")
+        self.report = StartupReport()
+        self._failed_devices = set()
+        self._uncalibrated = set()
+        errors = self._ForEachDevice(self.devices, self._ConnectDevice, timeout)
+
+        for index, device in enumerate(self.devices):
+            if device in errors:
+                self.report.failed[index] = errors[device]
+                self._failed_devices.add(device)
+                self.logger.warning(f"Failed to connect to device {index} ({device.connection}): {errors[device]}")
+            else:
+                self.report.connected.append(index)
+
+        if len(self.report.failed) > 0:
+            if not allow_partial:
+                self._DisconnectAll()
+                raise ConnectionError("Failed to connect to device(s): " + str(self.report.failed))
+            self._StartRetrying(timeout, retry_interval)
+        return self.report
+
+    def Calibrate(self, timeout = None, allow_partial = False, retry_interval = 5):
+        """
+        Calibrate the time synchronization for all connected devices concurrently.
+        Devices which fail to calibrate will be moved to the failed devices of the startup report
+        @param timeout: the maximum time in seconds to wait for each device. Default: None (wait forever)
+        @param allow_partial: if True, continue with the devices which could be calibrated and keep
+                              retrying the failed ones in the background. Otherwise, disconnect all devices
+                              and raise a ConnectionError if any device fails. Default: False
+        @param retry_interval: the time in seconds between retries for failed devices. Default: 5
+        @returns: the StartupReport for all devices
+        """
         self.logger.info("Calibrating devices")
+        connected = [self.devices[i] for i in self.report.connected]
+        errors = self._ForEachDevice(connected, self._CalibrateDevice, timeout)
+
+        for device in connected:
+            index = self.devices.index(device)
+            if device in errors:
+                self.report.connected.remove(index)
+                self.report.failed[index] = errors[device]
+                self._failed_devices.add(device)
+                self._uncalibrated.add(device)
+                self.logger.warning(f"Failed to calibrate device {index}: {errors[device]}")
+                continue
+            self.report.latency[index] = device.latency
+
+        self.logger.info(str(self.report))
+        if len(self.report.failed) > 0:
+            if not allow_partial:
+                self._DisconnectAll()
+                raise ConnectionError("Failed to connect or calibrate device(s): " + str(self.report.failed))
+            self._StartRetrying(timeout, retry_interval)
+        return self.report
+
+    def StopRetrying(self):
+        """
+        Stop reconnecting failed devices in the background.
+        NOTE: a connection attempt which is already running will not be interrupted
+        """
+        self._stop_retry.set()
+        self._retry_thread = None
+
+    def _ConnectDevice(self, device):
+        # establish hardware connection
+        device.connection.Connect()
+        # establish ALUP connection
+        device._AlupConnect()
+        self.logger.info("Connected to device: " + str(device.connection) + "\n" + str(device.configuration))
+
+    def _ResetConnection(self, device):
+        """
+        Close the connection of a device after a failed or timed out connection attempt, so it can be opened again
+        """
+        try:
+            device.connection.Disconnect()
+        except Exception as e:
+            self.logger.debug(f"Closing connection {device.connection} failed: {e!r}")
+
+    def _DisconnectAll(self):
+        """
+        Disconnect all devices which are connected, eg. after startup failed
+        """
         for device in self.devices:
-            device.Calibrate()
+            if device in self._pending:
+                # still busy with a hanging attempt
+                continue
+            if device in self._failed_devices and device not in self._uncalibrated:
+                self._ResetConnection(device)
+                continue
+            try:
+                device.Disconnect()
+            except Exception as e:
+                self.logger.warning(f"Failed to disconnect device {self._DeviceName(device)}: {e!r}")
+
+    def _CalibrateDevice(self, device):
+        device.Calibrate()
+        self.telemetry[device] = DeviceTelemetry(device)
+        self.logger.debug(f"Calibrated device {self._DeviceName(device)}, latency: {device.latency} ms")
+
+    def _ForEachDevice(self, devices, function, timeout = None):
+        """
+        Run the given function for each device in its own thread and wait for all of them
+        @param devices: the devices to run the function for
+        @param function: a function taking a device as only argument
+        @param timeout: the maximum time in seconds to wait for each device
+        @returns: a dict mapping each device which failed or timed out to its error message
+        """
+        errors = {}
+        threads = {}
+
+        def _Run(device):
+            try:
+                function(device)
+            except Exception as e:
+                errors[device] = repr(e)
+
+        for device in devices:
+            thread = threading.Thread(target=_Run, args=(device,), daemon=True)
+            thread.start()
+            threads[device] = thread
+
+        # all threads run in parallel, so each one gets the same deadline
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for device, thread in threads.items():
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+            if thread.is_alive():
+                errors[device] = f"Timed out after {timeout} s"
+                # remember the hanging attempt so that retries don't run concurrently with it
+                self._pending[device] = thread
+        return errors
+
+    def _StartRetrying(self, timeout, retry_interval):
+        if self._retry_thread is not None and self._retry_thread.is_alive():
+            return
+        self._stop_retry.clear()
+        self._retry_thread = threading.Thread(target=self._RetryDevices, args=(timeout, retry_interval), daemon=True)
+        self._retry_thread.start()
+
+    def _RetryDevices(self, timeout, retry_interval):
+        """
+        Periodically try to connect and calibrate all devices which failed at startup.
+        Devices which are connected but failed to calibrate are only calibrated again
+        """
+        while not self._stop_retry.wait(retry_interval):
+            failed = list(self.report.failed)
+            if len(failed) == 0:
+                break
+            for index in failed:
+                device = self.devices[index]
+                # wait for timed out attempts to give up before trying again
+                pending = self._pending.get(device)
+                if pending is not None:
+                    if pending.is_alive():
+                        continue
+                    del self._pending[device]
+
+                self.logger.info(f"Retrying device {index} ({device.connection})")
+                errors = self._ForEachDevice([device], self._RetryDevice, timeout)
+                if device in errors:
+                    self.report.failed[index] = errors[device]
+                    self.logger.debug(f"Retry for device {index} failed: {errors[device]}")
+                    continue
+
+                del self.report.failed[index]
+                self.report.connected.append(index)
+                self.report.latency[index] = device.latency
+                self._failed_devices.discard(device)
+                self.logger.info(f"Device {index} is now connected, latency: {device.latency} ms")
+
+    def _RetryDevice(self, device):
+        if device not in self._uncalibrated:
+            # the last attempt may have opened the connection before failing or timing out
+            self._ResetConnection(device)
+            self._ConnectDevice(device)
+            self._uncalibrated.add(device)
+        self._CalibrateDevice(device)
+        self._uncalibrated.discard(device)
+
+    def _DeviceName(self, device):
+        try:
+            return str(device.configuration.deviceName)
+        except AttributeError:
+            return str(device.connection)
 
         
 
     # convert the lightshow to a json file and save it to the given pat
-    def toJson(self, output_path, comments = None):
-        data = {}
-        if (comments is not None):
-            data['comments'] = comments
-        data['devices'] = self._DevicesToJSON()
-        data['timeline'] = self._FramesToJson()
+    # @param compression: a PaletteCompression to store the colors as palette indices. Default: None (store the hex colors)
+    def toJson(self, output_path, comments = None, compression = None):
+        data = self._HeaderToJson(comments)
+        encoded = None
+        if compression is not None:
+            encoded = compression.Encode(self.frames)
+            data['palettes'] = [NoIndent([Convert.intColorToHex(int(color)) for color in palette]) for palette in compression.palettes]
+        data['timeline'] = self._FramesToJson(encoded)
         json_string = json.dumps(data, cls=NoIndentEncoder, indent=4)
         with open(output_path, "w+") as f:
             f.write(json_string)
         
 
+    # convert everything except the frames to json format
+    def _HeaderToJson(self, comments = None):
+        data = {}
+        if (comments is not None):
+            data['comments'] = comments
+        corrections = self._CorrectionsToJson()
+        if len(corrections) > 0:
+            data['corrections'] = corrections
+        data['devices'] = self._DevicesToJSON()
+        return data
+
     def _DevicesToJSON(self):
         devices = []
         for device in self.devices:
             if isinstance(device.connection,  SerialConnection):
-                devices.append(NoIndent({'connection' : 'serial', 'port' : str(device.connection.port), 'baud' : str(device.connection.baud)}))
+                device_data = {'connection' : 'serial', 'port' : str(device.connection.port), 'baud' : str(device.connection.baud)}
             elif isinstance(device.connection,  TcpConnection):
-                devices.append(NoIndent({'connection' : 'tcp', 'address' : str(device.connection.remote_ip), 'port' : str(device.connection.remote_port)}))
+                device_data = {'connection' : 'tcp', 'address' : str(device.connection.remote_ip), 'port' : str(device.connection.remote_port)}
             else:
                 self.logger.error("Failed to parse device connection. Unsupported device connection type "  + str(device.connection))
+                continue
+            correction = self.corrections.get(device)
+            if correction is not None:
+                # named profiles are stored once in 'corrections' and referenced by name
+                device_data['correction'] = correction.name if correction.name is not None else correction.toJson()
+            devices.append(NoIndent(device_data))
         return devices
 
+    # collect all named color correction profiles
+    def _CorrectionsToJson(self):
+        corrections = {}
+        for correction in self.corrections.values():
+            if correction.name is not None:
+                corrections[correction.name] = NoIndent(correction.toJson())
+        return corrections
+
     # convert all frames of this lightshow to json format
-    def _FramesToJson(self):
+    # @param encoded: the palette encoded colors of each frame as returned by PaletteCompression.Encode(). Default: None
+    def _FramesToJson(self, encoded = None):
         out =  []
         for i in range(len(self.frames)):
-            for frame in self.frames[i]:
-                out.append(NoIndent({
-                        "timestamp" : frame.timestamp,
-                        "device" : i,
-                        "offset" : frame.offset,
-                        "command" : frame.command.name,
-                        "colors" : [Convert.intColorToHex(color) for color in frame.colors]
-                        }))
+            for j, frame in enumerate(self.frames[i]):
+                out.append(NoIndent(self._FrameToJson(frame, i, encoded[i][j] if encoded is not None else None)))
         return out
 
+    # convert a single frame to json format
+    # @param encoded: the (palette, indices) tuple of the frame if it is palette encoded. Default: None
+    def _FrameToJson(self, frame, device, encoded = None):
+        frame_data = {
+                "timestamp" : frame.timestamp,
+                "device" : device,
+                "offset" : frame.offset,
+                "command" : frame.command.name,
+                }
+        if encoded is None:
+            frame_data["colors"] = [Convert.intColorToHex(color) for color in frame.colors]
+        else:
+            palette, indices = encoded
+            frame_data["palette"] = palette
+            from .palette import IndicesToString
+            frame_data["indices"] = IndicesToString(indices)
+        return frame_data
+
 
 
     def __str__(self):
@@ -156,18 +582,28 @@ class Lightshow:
         with open(filename) as f:
             # 1. load in json
             self.logger.info("Loading lightshow from file '" + str(filename) + "'")
-            data = json.load(f)
+            with profiler.Stage("parse"):
+                data = json.load(f)
             # 2. initialize ALUP devices from json file 
             self._devicesFromJson(data)
             self.logger.info("Loaded " + str(len(self.devices)) + " devices from file")
             # 3. Load all animation steps (one array for each device)
-            self._framesFromJson(data)
+            with profiler.Stage("parse"):
+                self._framesFromJson(data)
+            with profiler.Stage("schedule"):
+                self.BuildIndex()
             self.logger.info("Loaded Frames for each device: " + str([len(i) for i in self.frames]))
 
 
     # load and initialize devices from a json object
     # NOTE: Devices are added in the same order as they appear in the JSON file
     def _devicesFromJson(self, data):
+        # named color correction profiles which can be referenced by devices
+        profiles = {}
+        if "corrections" in data or any("correction" in device_data for device_data in data["devices"]):
+            from .correction import ColorCorrection
+            profiles = {name : ColorCorrection.fromJson(profile, name) for name, profile in data.get("corrections", {}).items()}
+
         for device_data in data["devices"]:
             device = Device()
             self.logger.debug("Connecting to : " + str(device_data))
@@ -180,22 +616,27 @@ class Lightshow:
             else:
                 self.logger.error("Can't connect to device: Unknown connection type: " + str(device_data["connection"]))
                 return
+            # add the color correction profile of the device, either by name or inline
+            correction = device_data.get("correction")
+            if isinstance(correction, str):
+                if correction not in profiles:
+                    self.logger.error("Unknown color correction profile '" + correction + "' for device " + str(device_data))
+                else:
+                    self.corrections[device] = profiles[correction]
+            elif correction is not None:
+                self.corrections[device] = ColorCorrection.fromJson(correction)
             # add device to lightshow
             self.devices.append(device)
             # add an array to store the device's frames
             self.frames.append([])
 
-    def Connect(self):
-        self.logger.info("Connecting to devices...")
-        for device in self.devices:
-            # establish hardware connection
-            device.connection.Connect()
-            # establish ALUP connection
-            device._AlupConnect()
-            self.logger.info("Connected to device: " + str(device.connection) + "\n" + str(device.configuration))
-
-
     def _framesFromJson(self, data):
+        # palettes of palette compressed light shows as integer arrays
+        palettes = []
+        if "palettes" in data:
+            from .palette import PalettesFromJson, ExpandIndices
+            palettes = PalettesFromJson(data["palettes"])
+
         for frame_data in data["timeline"]:
             frame = Frame()
             # HACK: we store the relative timestamp in the field for the absolute timestamp
@@ -205,7 +646,10 @@ class Lightshow:
             frame.command = Command[frame_data["command"]]
             # convert the array of hex strings to integer colors
             # TODO: maybe do integrity checking (if string is real 24bit color)
-            frame.colors = [int(value, 16) for value in frame_data["colors"]]
+            if "indices" in frame_data:
+                frame.colors = ExpandIndices(palettes[frame_data["palette"]], frame_data["indices"])
+            else:
+                frame.colors = [int(value, 16) for value in frame_data["colors"]]
 
             # add frame to frame list for the device
             self.frames[frame_data["device"]].append(frame)
@@ -214,6 +658,147 @@ class Lightshow:
 
 
 
+class JsonStreamWriter:
+    """
+    Writes the frames of a light show to a json file one by one instead of converting all frames at once.
+    The resulting file is identical to Lightshow.toJson() if the frames are written in the same order
+    (all frames of device 0, then all frames of device 1, ...)
+    Usage:
+        with JsonStreamWriter(lightshow, "show.json") as writer:
+            writer.Write(frame, device=0)
+    """
+    def __init__(self, lightshow, output_path, comments = None):
+        """
+        Default constructor
+        @param lightshow: the light show providing the devices and color corrections
+        @param output_path: the path of the json file to write
+        @param comments: a list of comments for the json file. Default: None
+        """
+        self.lightshow = lightshow
+        self.output_path = output_path
+        self.comments = comments
+        self.frame_count = 0
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.output_path, "w+")
+        data = self.lightshow._HeaderToJson(self.comments)
+        data['timeline'] = []
+        header = json.dumps(data, cls=NoIndentEncoder, indent=4)
+        # cut off the empty timeline and the closing bracket to append the frames
+        self._file.write(header[:header.rindex("[")] + "[")
+        return self
+
+    def Write(self, frame, device = 0):
+        """
+        Append a frame for the given device index to the json file
+        """
+        self._file.write(("," if self.frame_count > 0 else "") + "\n        " + json.dumps(self.lightshow._FrameToJson(frame, device)))
+        self.frame_count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.write("\n    ]\n}" if self.frame_count > 0 else "]\n}")
+        self._file.close()
+        self._file = None
+
+
+class DeviceTelemetry:
+    """
+    Clock synchronization and lateness statistics of one device.
+    The clock drift is estimated from the change of the clock offset between two calibrations and used to
+    extrapolate the offset until the next calibration.
+    NOTE: The offset is read from Device.time_delta after Device.Calibrate(). This name and the sign convention
+          (OFFSET_SIGN) have not been verified against a specific pyalup release; check them against the installed
+          pyalup before relying on the drift compensation. The attribute missing is detected and logged by
+          Lightshow.Run() when recalibration is enabled.
+    """
+    # the minimum time in s between two recalibrations triggered by late frames
+    MIN_RECALIBRATION_GAP = 5
+    # smoothing factor of the late frame ratio
+    LATENESS_SMOOTHING = 0.05
+    # attribute of pyalup.Device holding the clock offset measured by Device.Calibrate() in ms
+    OFFSET_ATTRIBUTE = "time_delta"
+    # how pyalup applies the offset when converting local time stamps to device time stamps:
+    # +1 if device time = local time + offset, -1 if device time = local time - offset
+    OFFSET_SIGN = 1
+
+    def __init__(self, device):
+        self.latency = device.latency # in ms
+        self.offset = _ClockOffset(device) # clock offset of the device in ms, None if unknown
+        self.drift = 0.0 # drift of the clock offset in ms per second
+        self.recalibrations = 0
+        self.late_ratio = 0.0 # smoothed fraction of frames which were too late
+        self.last_calibration = time.monotonic() # time of the last successful offset measurement
+        self.last_attempt = self.last_calibration # time of the last calibration attempt, successful or not
+
+    def Update(self, device):
+        """
+        Update the statistics after a recalibration of the device
+        """
+        now = time.monotonic()
+        offset = _ClockOffset(device)
+        if offset is not None and self.offset is not None and now > self.last_calibration:
+            self.drift = (offset - self.offset) / (now - self.last_calibration)
+        self.offset = offset
+        self.latency = device.latency
+        self.last_calibration = now
+        self.last_attempt = now
+        self.recalibrations += 1
+        self.late_ratio = 0.0
+
+    def DriftCorrection(self):
+        """
+        @returns: the time in ms to add to local time stamps to compensate the estimated change of the clock offset
+                  since the last calibration, which pyalup does not know about yet
+        """
+        if self.drift == 0.0:
+            return 0
+        return DeviceTelemetry.OFFSET_SIGN * self.drift * (time.monotonic() - self.last_calibration)
+
+    def TrackLateness(self, late, sent):
+        """
+        Update the smoothed fraction of late frames
+        @param late: the number of frames which were skipped for being late
+        @param sent: the number of frames which were sent in time
+        """
+        # exponential moving average over all frames: late frames count as 1, frames sent in time as 0
+        keep = 1 - DeviceTelemetry.LATENESS_SMOOTHING
+        self.late_ratio = 1 - (keep ** late) * (1 - self.late_ratio)
+        self.late_ratio *= keep ** sent
+
+    def __str__(self):
+        return f"latency: {self.latency} ms, clock offset: {self.offset} ms, drift: {self.drift:.4f} ms/s, recalibrations: {self.recalibrations}, late frames: {100 * self.late_ratio:.1f}%"
+
+
+def _ClockOffset(device):
+    """
+    Get the clock offset measured by the last calibration of the device, or None if the device doesn't provide it
+    """
+    offset = getattr(device, DeviceTelemetry.OFFSET_ATTRIBUTE, None)
+    if isinstance(offset, (int, float)):
+        return offset
+    return None
+
+
+class StartupReport:
+    """
+    Summary of connecting and calibrating the devices of a lightshow.
+    Devices are referred to by their index in Lightshow.devices
+    """
+    def __init__(self):
+        self.connected = [] # indices of all connected devices
+        self.failed = {} # device index -> error message
+        self.latency = {} # device index -> calibrated latency in ms
+
+    def __str__(self):
+        lines = [f"Startup report: {len(self.connected)} connected, {len(self.failed)} failed"]
+        for index in sorted(self.connected):
+            lines.append(f" - Device {index}: connected, latency: {self.latency.get(index, '-')} ms")
+        for index in sorted(self.failed):
+            lines.append(f" - Device {index}: failed ({self.failed[index]})")
+        return "\n".join(lines)
+
+
 """
     Prettier JSON encoder
     Credits: https://stackoverflow.com/a/25935321
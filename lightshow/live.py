@@ -0,0 +1,102 @@
+import logging
+import time
+import cv2
+from pyalup.Frame import Frame
+
+from .palette import RGBArrayToInt
+from .profiling import profiler
+
+class LivePlayback():
+    """
+    Class playing a video directly on the devices of a light show without converting it first.
+    Frames are decoded, sampled using one Sampler for each device and sent paced to the video time stamps.
+    Frames which are already too late are skipped after grabbing them, without retrieving (converting) and sampling their image data.
+    """
+    def __init__(self, lightshow, samplers, source):
+        """
+        Default constructor
+        @param lightshow: a connected and calibrated light show providing the devices
+        @param samplers: one Sampler for each device of the light show
+        @param source: anything cv2.VideoCapture can open: a video file, a named pipe, a stream URL or an integer camera index
+        """
+        self.logger = logging.getLogger(__name__)
+        self.lightshow = lightshow
+        self.samplers = samplers
+        self.source = source
+
+        # statistics of the last call to Run()
+        self.played_frames = 0
+        self.skipped_frames = 0
+
+    def Run(self):
+        """
+        Play the video until it ends
+        """
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            self.logger.error("Could not open video source " + str(self.source))
+            return
+
+        # cameras have no meaningful time stamps; their frames are shown immediately
+        is_camera = isinstance(self.source, int)
+        devices = self.lightshow.devices
+        # send each frame early enough for the slowest device
+        lead = max([device.latency for device in devices] + [0])
+        t_start = time.time() * 1000 + lead
+
+        self.played_frames = 0
+        self.skipped_frames = 0
+        self.logger.info("Starting live playback of " + str(self.source))
+        try:
+            while cap.isOpened():
+                # only grab the next frame; retrieving and sampling it is not needed if it is already late
+                # NOTE: depending on the backend (eg. FFmpeg), grab() still decodes the frame
+                with profiler.Stage("decode"):
+                    grabbed = cap.grab()
+                if not grabbed:
+                    self.logger.info("Video end reached.")
+                    break
+
+                timestamp = 0
+                if not is_camera:
+                    timestamp = t_start + cap.get(cv2.CAP_PROP_POS_MSEC)
+                    now = time.time() * 1000
+                    if timestamp <= now + lead // 2:
+                        self.skipped_frames += 1
+                        continue
+                    # don't run ahead of the video further than needed
+                    if timestamp - lead > now:
+                        time.sleep((timestamp - lead - now) / 1000)
+
+                with profiler.Stage("decode"):
+                    ret, frame = cap.retrieve()
+                if not ret:
+                    continue
+                self._Send(frame, timestamp)
+                self.played_frames += 1
+        finally:
+            cap.release()
+            total = max(self.played_frames + self.skipped_frames, 1)
+            self.logger.info(f"Played {self.played_frames} frames, skipped {self.skipped_frames} late frames ({100 * self.skipped_frames / total}%)")
+
+    def _Send(self, frame, timestamp):
+        """
+        Sample the given video frame for every device and send it
+        """
+        for device, sampler in zip(self.lightshow.devices, self.samplers):
+            if device in self.lightshow._failed_devices:
+                continue
+            colors = sampler.Sample(frame)
+            with profiler.Stage("encode"):
+                colors = RGBArrayToInt(colors).tolist()
+            correction = self.lightshow.corrections.get(device)
+            if correction is not None:
+                with profiler.Stage("correct"):
+                    colors = correction.Apply(colors)
+
+            alup_frame = Frame()
+            alup_frame.colors = colors
+            alup_frame.timestamp = int(timestamp)
+            with profiler.Stage("send"):
+                device.frame = alup_frame
+                device.Send()
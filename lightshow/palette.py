@@ -0,0 +1,227 @@
+import base64
+import logging
+import numpy as np
+
+class PaletteCompression():
+    """
+    Class compressing the colors of light show frames using palettes of at most 256 colors.
+    Each frame then only stores one uint8 palette index per LED instead of a 24-bit color.
+    If a palette would need more colors, the colors are quantized using median cut or k-means.
+    """
+    METHODS = ["median_cut", "kmeans"]
+
+    def __init__(self, n_colors = 256, method = "median_cut", max_error = None, segment_length = None):
+        """
+        Default constructor
+        @param n_colors: the maximum number of colors per palette (1 - 256). Default: 256
+        @param method: the quantization method used if a palette needs more than n_colors colors. Either "median_cut" or "kmeans". Default: "median_cut"
+        @param max_error: the maximum mean quantization error (euclidean RGB distance) of each palette. Segments exceeding it
+                          are split in half until the error is small enough. Default: None (no bound)
+        @param segment_length: the number of frames sharing one palette. Default: None (one global palette for all frames)
+        """
+        if n_colors < 1 or n_colors > 256:
+            raise ValueError("Palettes can contain 1 to 256 colors, got " + str(n_colors))
+        if method not in PaletteCompression.METHODS:
+            raise ValueError("Unknown quantization method: " + str(method))
+        if segment_length is not None and segment_length < 1:
+            raise ValueError("Palette segments need at least one frame, got " + str(segment_length))
+
+        self.logger = logging.getLogger(__name__)
+        self.n_colors = n_colors
+        self.method = method
+        self.max_error = max_error
+        self.segment_length = segment_length
+
+        # results of the last call to Encode()
+        self.palettes = [] # list of uint32 arrays containing integer colors
+        self.raw_bytes = 0 # size of all colors as 24-bit values
+        self.compressed_bytes = 0 # size of all palette indices and palettes
+        self.mean_error = 0.0 # mean quantization error over all LEDs of all frames
+        self.peak_error = 0.0 # largest quantization error of a single LED
+        self.exceeding_segments = 0 # number of palettes exceeding max_error even for a single frame
+
+    def Encode(self, frames):
+        """
+        Compress the colors of the given frames
+        @param frames: a 2d-array containing a list of frames for each device
+        @returns: a 2d-array with a tuple (palette index, uint8 index array) for each frame of each device
+        """
+        self.palettes = []
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.mean_error = 0.0
+        self.peak_error = 0.0
+        self.exceeding_segments = 0
+        error_sum = 0.0
+
+        # all frames in order as (device, frame index, colors)
+        items = []
+        for i, device_frames in enumerate(frames):
+            for j, frame in enumerate(device_frames):
+                items.append((i, j, np.asarray(frame.colors, dtype=np.uint32)))
+
+        encoded = [[None for _ in device_frames] for device_frames in frames]
+        segment_length = self.segment_length if self.segment_length is not None else max(len(items), 1)
+        segments = [items[k:k + segment_length] for k in range(0, len(items), segment_length)]
+
+        while len(segments) > 0:
+            segment = segments.pop(0)
+            palette, indices, errors = self._Quantize(np.concatenate([colors for _, _, colors in segment]))
+
+            # split the segment if the error bound is exceeded
+            if self.max_error is not None and len(errors) > 0 and errors.mean() > self.max_error:
+                if len(segment) > 1:
+                    half = len(segment) // 2
+                    segments[0:0] = [segment[:half], segment[half:]]
+                    continue
+                # a single frame can't be split any further
+                self.exceeding_segments += 1
+
+            palette_index = len(self.palettes)
+            self.palettes.append(palette)
+            self.compressed_bytes += 3 * len(palette)
+            offset = 0
+            for i, j, colors in segment:
+                encoded[i][j] = (palette_index, indices[offset:offset + len(colors)])
+                offset += len(colors)
+
+            self.raw_bytes += 3 * len(indices)
+            self.compressed_bytes += len(indices)
+            if len(errors) > 0:
+                error_sum += errors.sum()
+                self.peak_error = max(self.peak_error, float(errors.max()))
+
+        n_colors = self.raw_bytes // 3
+        self.mean_error = error_sum / n_colors if n_colors > 0 else 0.0
+        if self.exceeding_segments > 0:
+            self.logger.warning(f"{self.exceeding_segments} single frame palette(s) exceed the maximum error of {self.max_error}; "
+                                f"use more than {self.n_colors} colors per palette to meet it")
+        return encoded
+
+    def Summary(self):
+        """
+        @returns: a human readable summary of the last compression
+        """
+        ratio = self.raw_bytes / self.compressed_bytes if self.compressed_bytes > 0 else 1.0
+        summary = (f"Palette compression: {len(self.palettes)} palette(s), {self.raw_bytes} -> {self.compressed_bytes} bytes "
+                   f"(ratio {ratio:.2f}:1), quantization error: mean {self.mean_error:.2f}, max {self.peak_error:.2f}")
+        if self.exceeding_segments > 0:
+            summary += f", {self.exceeding_segments} palette(s) exceed the maximum error of {self.max_error}"
+        return summary
+
+    def _Quantize(self, colors):
+        """
+        Find a palette for the given colors
+        @param colors: uint32 array of integer colors
+        @returns: the palette as uint32 array, the uint8 palette index of each color and the quantization error of each color
+        """
+        unique, inverse, counts = np.unique(colors, return_inverse=True, return_counts=True)
+        inverse = inverse.reshape(-1)
+        if len(unique) <= self.n_colors:
+            # exact palette, no quantization needed
+            return unique.astype(np.uint32), inverse.astype(np.uint8), np.zeros(len(colors))
+
+        rgb = IntToRGBArray(unique).astype(np.float64)
+        if self.method == "kmeans":
+            palette_rgb, labels = self._KMeans(rgb, counts)
+        else:
+            palette_rgb, labels = self._MedianCut(rgb, counts)
+
+        palette = RGBArrayToInt(np.clip(np.rint(palette_rgb), 0, 255).astype(np.uint32))
+        unique_errors = np.linalg.norm(rgb - np.clip(np.rint(palette_rgb), 0, 255)[labels], axis=1)
+        return palette, labels[inverse].astype(np.uint8), unique_errors[inverse]
+
+    def _MedianCut(self, rgb, counts):
+        """
+        Split the RGB color space into n_colors boxes at the weighted median of their widest channel
+        @returns: the weighted mean color of each box and the box index of each color
+        """
+        boxes = [np.arange(len(rgb))]
+        ranges = [np.ptp(rgb, axis=0)]
+        while len(boxes) < self.n_colors:
+            # split the box with the widest channel range
+            widest = int(np.argmax([r.max() for r in ranges]))
+            if ranges[widest].max() == 0:
+                break
+            box = boxes[widest]
+            channel = int(np.argmax(ranges[widest]))
+
+            order = box[np.argsort(rgb[box, channel], kind="stable")]
+            weights = np.cumsum(counts[order])
+            split = int(np.searchsorted(weights, weights[-1] / 2))
+            split = min(max(split, 1), len(order) - 1)
+            boxes[widest:widest + 1] = [order[:split], order[split:]]
+            ranges[widest:widest + 1] = [np.ptp(rgb[order[:split]], axis=0), np.ptp(rgb[order[split:]], axis=0)]
+
+        palette = np.zeros((len(boxes), 3))
+        labels = np.zeros(len(rgb), dtype=np.intp)
+        for k, box in enumerate(boxes):
+            palette[k] = np.average(rgb[box], axis=0, weights=counts[box])
+            labels[box] = k
+        return palette, labels
+
+    def _KMeans(self, rgb, counts, max_samples = 100000):
+        """
+        Cluster the colors into n_colors clusters using k-means
+        @returns: the center of each cluster and the cluster index of each color
+        """
+        import cv2
+
+        # k-means can't use weights, so sample the colors according to their frequency
+        rng = np.random.default_rng(0)
+        samples = rgb[rng.choice(len(rgb), size=min(max_samples, int(counts.sum())), p=counts / counts.sum())]
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.5)
+        _, _, centers = cv2.kmeans(samples.astype(np.float32), self.n_colors, None, criteria, 3, cv2.KMEANS_PP_CENTERS)
+        centers = centers.astype(np.float64)
+        return centers, NearestColor(rgb, centers)
+
+
+def NearestColor(rgb, palette, block_size = 4096):
+    """
+    Find the index of the nearest palette color for each color
+    @param rgb: float array of shape (n, 3)
+    @param palette: float array of shape (k, 3)
+    @returns: array of n palette indices
+    """
+    labels = np.zeros(len(rgb), dtype=np.intp)
+    # process in blocks to keep the distance matrix small
+    for start in range(0, len(rgb), block_size):
+        block = rgb[start:start + block_size]
+        distances = ((block[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2)
+        labels[start:start + block_size] = np.argmin(distances, axis=1)
+    return labels
+
+def IntToRGBArray(colors):
+    """
+    Convert an array of integer colors to an array of shape (n, 3) with the RGB values
+    """
+    colors = np.asarray(colors, dtype=np.uint32)
+    return np.stack([(colors >> 16) & 255, (colors >> 8) & 255, colors & 255], axis=-1)
+
+def RGBArrayToInt(rgb):
+    """
+    Convert an array of shape (n, 3) with RGB values to an array of integer colors
+    """
+    rgb = np.asarray(rgb, dtype=np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+def IndicesToString(indices):
+    """
+    Encode a uint8 index array as base64 string for storing it in JSON files
+    """
+    return base64.b64encode(np.asarray(indices, dtype=np.uint8).tobytes()).decode("ascii")
+
+def PalettesFromJson(palettes):
+    """
+    Convert palettes of hex strings as stored in light show files to arrays of integer colors
+    """
+    return [np.array([int(value, 16) for value in palette], dtype=np.uint32) for palette in palettes]
+
+def ExpandIndices(palette, indices):
+    """
+    Expand a base64 encoded uint8 index array back to integer colors
+    @param palette: uint32 array of integer colors
+    @param indices: base64 string as created by IndicesToString()
+    @returns: a list of integer colors
+    """
+    return palette[np.frombuffer(base64.b64decode(indices), dtype=np.uint8)].tolist()
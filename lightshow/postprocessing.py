@@ -1,5 +1,6 @@
 import abc
 import colorsys
+import numpy as np
 
 from pyalup.Frame import Frame
 
@@ -40,6 +41,10 @@ class Postprocessing:
 
         #print(f"Old min: {darkest_pixel}, old max {brightest_pixel}")
 
+        # nothing to normalize if all pixels have the same brightness (eg. a region containing a letterbox bar)
+        if brightest_pixel <= darkest_pixel:
+            return frames
+
         # normalize each colors contrast
         for frame in frames:
             for j in range(len(frame.colors)):
@@ -61,6 +66,32 @@ class Postprocessing:
         return frames
     
 
+    @abc.abstractmethod
+    def NormalizeContrastColors(colors, darkest, brightest, min_brightness = 0, max_brightness = 1.0):
+        """
+        Vectorized version of NormalizeContrast for a single array of colors, using a brightness range which is already known.
+        This allows normalizing frames one by one, eg. while streaming them to a file.
+        @param colors: a numpy array of shape (n, 3) containing RGB colors
+        @param darkest: the floatingpoint brightness (HSV value, 0.0 - 1.0) of the darkest pixel of all frames
+        @param brightest: the floatingpoint brightness (HSV value, 0.0 - 1.0) of the brightest pixel of all frames
+        @param min_brightness: the minimum floatingpoint brightness of the result (0.0 - 1.0). Default: 0
+        @param max_brightness: the maximum  floatingpoint brightness of the result (0.0 - 1.0). Default: 1.0
+
+        @returns: a numpy array of shape (n, 3) containing the normalized RGB colors
+        """
+        if brightest <= darkest:
+            return colors
+        rgb = np.asarray(colors, dtype=np.float64) / 255
+        value = rgb.max(axis=1)
+        new_value = (value - darkest) * ((max_brightness - min_brightness) / (brightest - darkest)) + min_brightness
+
+        # changing the HSV value while keeping hue and saturation scales all channels by the same factor
+        # NOTE: black pixels have no saturation and become gray
+        scale = np.divide(new_value, value, out=np.zeros_like(value), where=value > 0)
+        result = np.where((value > 0)[:, None], rgb * scale[:, None], new_value[:, None])
+        # truncate like NormalizeContrast does; the epsilon compensates for rounding errors
+        return np.clip((result * 255 + 1e-9).astype(np.int64), 0, 255).astype(np.uint8)
+
     def HighPass(frames, cuttoff):
         """
         Apply a high pass to the brightness of the given frames
@@ -83,6 +114,26 @@ class Postprocessing:
         return frames
 
 
+class BrightnessRange:
+    """
+    Class tracking the brightness (HSV value) of the darkest and brightest pixel of a stream of colors
+    """
+    def __init__(self):
+        self.darkest = 1.0
+        self.brightest = 0.0
+
+    def Update(self, colors):
+        """
+        Include the given colors in the brightness range
+        @param colors: a numpy array of shape (n, 3) containing RGB colors
+        """
+        if len(colors) == 0:
+            return
+        value = np.asarray(colors).max(axis=1)
+        self.darkest = min(self.darkest, value.min() / 255)
+        self.brightest = max(self.brightest, value.max() / 255)
+
+
 def test():
     # test high pass
     frame = Frame()
@@ -100,6 +151,18 @@ def test():
     result =  Postprocessing.NormalizeContrast([frame])[0]
     assert result.colors ==[0x000000, 0x00ff00, 0x0000ff, 0xff0000, 0xffffff]
 
+    # constant brightness can't be normalized and is kept
+    frame.colors = [0x202020, 0x202020]
+    result =  Postprocessing.NormalizeContrast([frame])[0]
+    assert result.colors == [0x202020, 0x202020]
+
+    # test streamed normalization
+    colors = np.array([Convert.intToRGB(color) for color in [0x000000, 0x004400, 0x000044, 0x440000, 0x444444]], dtype=np.uint8)
+    brightness = BrightnessRange()
+    brightness.Update(colors)
+    result = Postprocessing.NormalizeContrastColors(colors, brightness.darkest, brightness.brightest)
+    assert [Convert.rgbToInt(color) for color in result.tolist()] == [0x000000, 0x00ff00, 0x0000ff, 0xff0000, 0xffffff]
+
 
 if __name__ == "__main__":
     test()
\ No newline at end of file
@@ -0,0 +1,176 @@
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+class Profiler():
+    """
+    Class collecting the time spent in named stages, eg. "decode" or "send".
+    When disabled, Stage() returns a shared no-op context manager so instrumented code stays cheap.
+    Results can be exported as text summary or as Chrome trace JSON (chrome://tracing, https://ui.perfetto.dev)
+    Usage:
+        profiler.Enable()
+        with profiler.Stage("send"):
+            device.Send()
+        profiler.Save("trace.json")
+    """
+    def __init__(self, max_events = 1000000):
+        """
+        Default constructor
+        @param max_events: the maximum number of single events kept for the Chrome trace. Summary statistics
+                           are kept for all events. Default: 1000000
+        """
+        self.enabled = False
+        self.max_events = max_events
+        self._events = [] # (name, thread id, start in ns, duration in ns)
+        self._stats = {} # name -> [count, total ns, max ns]
+        self._lock = threading.Lock()
+        self._t_start = time.perf_counter_ns()
+        self._cprofiles = [] # one cProfile.Profile for each profiled thread
+
+    def Enable(self, cprofile = False):
+        """
+        Start recording stages
+        @param cprofile: additionally run cProfile for the calling thread and all threads started afterwards. Default: False
+        """
+        self.enabled = True
+        self._t_start = time.perf_counter_ns()
+        if cprofile:
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+            self._cprofiles = [profile]
+            # cProfile only measures the thread enabling it; the hook enables a profile in each new thread
+            threading.setprofile(self._ProfileThread)
+
+    def Disable(self):
+        """
+        Stop recording stages. Recorded results are kept
+        """
+        self.enabled = False
+        threading.setprofile(None)
+        for profile in self._cprofiles:
+            profile.disable()
+
+    def Stage(self, name):
+        """
+        Get a context manager measuring the time spent in the stage with the given name
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def Record(self, name, start, duration):
+        """
+        Record a stage which was measured manually
+        @param name: the name of the stage
+        @param start: the start time from time.perf_counter_ns()
+        @param duration: the duration in ns
+        """
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = [0, 0, 0]
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+            if len(self._events) < self.max_events:
+                self._events.append((name, threading.get_ident(), start, duration))
+
+    def Summary(self):
+        """
+        @returns: a text table with the number of calls, total, mean and maximum time of each stage
+        """
+        lines = [f"{'Stage':<16} {'Calls':>10} {'Total [ms]':>12} {'Mean [ms]':>10} {'Max [ms]':>10}"]
+        for name, (count, total, peak) in sorted(self._stats.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<16} {count:>10} {total / 1e6:>12.2f} {total / count / 1e6:>10.3f} {peak / 1e6:>10.3f}")
+        if len(self._cprofiles) > 0:
+            stream = io.StringIO()
+            self._CProfileStats(stream).sort_stats("cumtime").print_stats(30)
+            lines.append("")
+            lines.append(stream.getvalue())
+        return "\n".join(lines)
+
+    def ChromeTrace(self):
+        """
+        @returns: the recorded events in Chrome trace event format
+        """
+        pid = os.getpid()
+        events = [{"name" : name, "ph" : "X", "pid" : pid, "tid" : tid, "ts" : (start - self._t_start) / 1000, "dur" : duration / 1000}
+                  for name, tid, start, duration in self._events]
+        return {"traceEvents" : events, "displayTimeUnit" : "ms"}
+
+    def Save(self, output):
+        """
+        Save the results. Files ending with .json get a Chrome trace, everything else a text summary.
+        If cProfile is enabled, its raw stats are saved next to the output as .prof file
+        @param output: the file to save to or "-" to print the summary
+        """
+        self.Disable()
+        if output == "-":
+            print(self.Summary())
+        elif output.endswith(".json"):
+            with open(output, "w") as f:
+                json.dump(self.ChromeTrace(), f)
+        else:
+            with open(output, "w") as f:
+                f.write(self.Summary())
+        if len(self._cprofiles) > 0 and output != "-":
+            self._CProfileStats().dump_stats(os.path.splitext(output)[0] + ".prof")
+
+    def _ProfileThread(self, frame, event, arg):
+        """
+        Profile hook called once at the start of each new thread; replaces itself with a cProfile.Profile for the thread
+        """
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: the profile of the enabling thread already covers all threads
+            sys.setprofile(None)
+            return
+        with self._lock:
+            self._cprofiles.append(profile)
+
+    def _CProfileStats(self, stream = None):
+        """
+        @returns: the pstats.Stats of all profiled threads combined
+        """
+        import pstats
+        with self._lock:
+            profiles = list(self._cprofiles)
+        stats = pstats.Stats(profiles[0], stream=stream)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+class _Stage():
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.Record(self.name, self.start, time.perf_counter_ns() - self.start)
+
+
+class _NullStage():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+# shared profiler used by the player, the converter and Ambilight
+profiler = Profiler()
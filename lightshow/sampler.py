@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+
+from .profiling import profiler
+
+class Sampler():
+    """
+    Class sampling the LED colors of one arrangement from video frames.
+    Optionally, only a sub-region of each frame is used.
+    """
+    def __init__(self, arrangement, region = None, interpolation = cv2.INTER_AREA, sparse = False, footprint = 1.0, kernel = "box", max_samples = 64):
+        """
+        Default constructor
+        @param arrangement: the arrangement of the LEDs to sample
+        @param region: the part of the frame to sample from as (x, y, width, height) in fractions of the
+                       frame size (0.0 - 1.0). Default: None (use the whole frame)
+        @param interpolation: the cv2 interpolation mode used to rescale the frame. Default: cv2.INTER_AREA
+        @param sparse: sample using the sparse sampling matrix of the arrangement instead of rescaling the whole frame.
+                       The interpolation is ignored in this case. Default: False
+        @param footprint: see Arrangement.GetSamplingMatrix(). Only used if sparse is set. Default: 1.0
+        @param kernel: see Arrangement.GetSamplingMatrix(). Only used if sparse is set. Default: "box"
+        @param max_samples: see Arrangement.GetSamplingMatrix(). Only used if sparse is set. Default: 64
+        """
+        self.arrangement = arrangement
+        self.region = region
+        self.interpolation = interpolation
+        self.sparse = sparse
+        self.footprint = footprint
+        self.kernel = kernel
+        self.max_samples = max_samples
+        self.mask = arrangement.GetMask()
+        self._resized_frame = None # the last rescaled and masked frame; see resized_frame
+        self._colors = None # the last sparse sampled BGR colors, used to build resized_frame on demand
+
+        # LED indices and positions as arrays for vectorized sampling
+        coordinates = np.array(arrangement.coordinates, dtype=np.intp).reshape(-1, 3)
+        self._indices = coordinates[:, 0]
+        self._x = coordinates[:, 1]
+        self._y = coordinates[:, 2]
+
+    @property
+    def resized_frame(self):
+        """
+        The last sampled frame in the resolution of the arrangement, with all pixels except the LEDs masked; useful for live viewing.
+        When sampling sparse, it is only built when requested. None if nothing was sampled yet
+        """
+        if self._resized_frame is None and self._colors is not None:
+            self._resized_frame = self.arrangement.ColorsToFrame(self._colors)
+        return self._resized_frame
+
+    def Crop(self, frame):
+        """
+        Crop the given frame to the region of this sampler
+        @param frame: a cv2 Mat or numpy array containing image data
+        @returns: a view of the frame containing only the region
+        """
+        if self.region is None:
+            return frame
+        height, width = frame.shape[:2]
+        x, y, w, h = self.region
+        x0 = int(round(x * width))
+        y0 = int(round(y * height))
+        x1 = max(x0 + 1, int(round((x + w) * width)))
+        y1 = max(y0 + 1, int(round((y + h) * height)))
+        return frame[y0:y1, x0:x1]
+
+    def Sample(self, frame):
+        """
+        Sample the LED colors from a BGR frame
+        @param frame: a cv2 Mat or numpy array containing BGR image data
+        @returns: a numpy array of shape (number of LEDs, 3) containing the RGB color of each LED, ordered by LED index
+        """
+        if self.sparse:
+            with profiler.Stage("sample"):
+                colors = self.arrangement.Sample(self.Crop(frame), self.footprint, self.kernel, self.max_samples)[:, :3]
+            # the preview frame is only built if resized_frame is used
+            self._colors = colors
+            self._resized_frame = None
+            # convert BGR to RGB
+            return colors[:, ::-1]
+
+        # rescale frame to the same resolution as the arrangement
+        with profiler.Stage("resize"):
+            resized_frame = cv2.resize(self.Crop(frame), self.arrangement.shape, interpolation=self.interpolation)
+            self._resized_frame = cv2.bitwise_and(resized_frame, self.mask)
+
+        with profiler.Stage("sample"):
+            colors = np.zeros((len(self._indices), 3), dtype=np.uint8)
+            # convert BGR to RGB while sampling at the LED positions
+            colors[self._indices] = self._resized_frame[self._y, self._x, ::-1]
+        return colors
+
+
+def RegionFromString(parameters : str):
+    """
+    Parse a region from a string of comma separated fractions
+    Format: [x],[y],[width],[height] eg: 0,0,0.5,1 for the left half of the frame
+    """
+    region = tuple(float(value) for value in parameters.split(','))
+    if len(region) != 4:
+        raise ValueError("A region needs exactly 4 values: x,y,width,height")
+    if any(value < 0 or value > 1 for value in region) or region[2] <= 0 or region[3] <= 0:
+        raise ValueError("Region values need to be fractions between 0.0 and 1.0")
+    return region
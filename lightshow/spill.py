@@ -0,0 +1,50 @@
+import os
+import numpy as np
+
+class SpillBuffer():
+    """
+    Class storing the sampled colors of one device in a compact binary file instead of in memory.
+    Each frame is stored as n_leds * 3 bytes (RGB) plus its 64-bit time stamp.
+    """
+    def __init__(self, directory, name, n_leds):
+        """
+        Default constructor
+        @param directory: the directory to create the buffer files in, eg. a temporary directory
+        @param name: the name of the buffer files
+        @param n_leds: the number of LEDs (colors) of each frame
+        """
+        self.n_leds = n_leds
+        self.frame_count = 0
+        self._colors_path = os.path.join(directory, name + ".rgb")
+        self._timestamps_path = os.path.join(directory, name + ".ts")
+        self._colors_file = open(self._colors_path, "wb")
+        self._timestamps_file = open(self._timestamps_path, "wb")
+
+    def Append(self, timestamp, colors):
+        """
+        Append a frame to the buffer
+        @param timestamp: the time stamp of the frame in ms
+        @param colors: a numpy array of shape (n_leds, 3) containing RGB colors
+        """
+        np.asarray(colors, dtype=np.uint8).tofile(self._colors_file)
+        np.array([timestamp], dtype=np.int64).tofile(self._timestamps_file)
+        self.frame_count += 1
+
+    def Frames(self):
+        """
+        Close the buffer for writing and iterate over all frames without loading them into memory
+        @returns: a generator yielding a tuple (timestamp, colors) for each frame
+        """
+        self.Close()
+        if self.frame_count == 0 or self.n_leds == 0:
+            return
+        colors = np.memmap(self._colors_path, dtype=np.uint8, mode="r", shape=(self.frame_count, self.n_leds, 3))
+        timestamps = np.memmap(self._timestamps_path, dtype=np.int64, mode="r", shape=(self.frame_count,))
+        for i in range(self.frame_count):
+            yield int(timestamps[i]), np.array(colors[i])
+        del colors, timestamps
+
+    def Close(self):
+        if not self._colors_file.closed:
+            self._colors_file.close()
+            self._timestamps_file.close()
@@ -6,6 +6,7 @@ import threading
 import uuid
 import sys
 import argparse
+import atexit
 import pyalup
 from pyalup.Device import Device
 from pyalup.Frame import Frame, Command
@@ -17,6 +18,7 @@ SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 from lightshow.lightshow import Lightshow
+from lightshow.profiling import profiler
 
 parser = argparse.ArgumentParser(prog="Lightshow Player", description="Play back lightshow JSON files")
 # setup arg parser
@@ -25,13 +27,33 @@ parser.add_argument('-c', '--countdown', default=0, type=int, help="Show a count
 parser.add_argument('--loop', action='store_true', help="Loop the light show indefinitely") 
 parser.add_argument('-v', '--verbose', action='store_true', help="Enable verbose logging") 
 parser.add_argument('--speed', default=1, type=float, help="The playback speed multiplier. Default 1") 
+parser.add_argument('--start', default="0", help="The time of the light show to start playing at. Format: {{[hh]:}[mm]:}[ss]{.[fff]} eg: 45:00 or 90.5. Default 0")
+parser.add_argument('--end', default=None, help="The time of the light show to stop playing at. Same format as --start. Default: play until the end")
+parser.add_argument('--timeout', default=None, type=float, help="The maximum time in seconds to wait for each device to connect and calibrate. Default: wait forever")
+parser.add_argument('--partial', action='store_true', help="Start the light show with all devices which could be connected and keep retrying the others in the background")
+parser.add_argument('--retry_interval', default=5, type=float, help="The time in seconds between reconnection attempts when using --partial. Default 5")
 parser.add_argument('--loglevel', default='INFO', help='Specify the minimum level for log messages (Either String or Int value). Possible log levels: NOTSET (0), DEBUG (10), INFO (20), WARNING (30), ERROR (40), CRITICAL (50). Default: INFO')
 
+parser.add_argument('--recalibrate', default=None, type=float, help="Recalibrate the clock offset and latency of each device every n seconds while playing. Default: only calibrate once")
+parser.add_argument('--recalibrate_on_late', default=None, type=float, help="Recalibrate a device early when the smoothed fraction of its late frames exceeds this value (0.0 - 1.0). Default: never")
+parser.add_argument('--profile', default=None, help="Measure the time spent in parsing, scheduling and sending and save it to this file when done. Files ending with .json get a Chrome trace, others a text summary. Use - to print the summary")
+parser.add_argument('--cprofile', action='store_true', help="Additionally run cProfile. Only used with --profile")
+
 parser.add_argument('--serial', nargs=1, default=None, help="Specify a serial connected ALUP device replacing the first device of the lightshow: [PORT]{:[BAUD]} eg: COM7:115200. Default Baud:115200")
 parser.add_argument('--tcp', nargs=1, default=None, help="Specify a TCP connected ALUP device replacing the first device of the lightshow. Format: [ip]{:[BAUD]} eg: 127.0.0.1:5012. Default Port: 5012")
 
 def main():
     args = parser.parse_args()
+    if args.profile is not None:
+        profiler.Enable(args.cprofile)
+        atexit.register(profiler.Save, args.profile)
+    try:
+        start = TimeFromString(args.start)
+        end = TimeFromString(args.end) if args.end is not None else None
+    except ValueError:
+        parser.error("Invalid time format for --start or --end")
+    if end is not None and end <= start:
+        parser.error("--end needs to be later than --start")
     logging.basicConfig(format="[%(asctime)s %(levelname)s]: %(message)s", datefmt="%H:%M:%S")
     lightshow = Lightshow()
     SetLogLevel(lightshow.logger, args.loglevel)
@@ -61,21 +83,33 @@ def main():
     
 
     # establish connection
-    lightshow.Connect()
+    try:
+        lightshow.Connect(timeout=args.timeout, allow_partial=args.partial, retry_interval=args.retry_interval)
+    except ConnectionError as e:
+        logging.error(str(e))
+        return
     # calibrate time stamps
-    lightshow.Calibrate()
+    try:
+        lightshow.Calibrate(timeout=args.timeout, allow_partial=args.partial, retry_interval=args.retry_interval)
+    except ConnectionError as e:
+        logging.error(str(e))
+        return
+    lightshow.recalibration_interval = args.recalibrate
+    lightshow.recalibration_lateness = args.recalibrate_on_late
 
     CountDown(args.countdown)
 
     try:
         # run light show
         while True:
-            lightshow.Run(args.speed)
+            lightshow.Run(args.speed, start, end)
             if(not args.loop):
                break
     except KeyboardInterrupt:
         print("CTL + C pressed, stopping.")
 
+    lightshow.StopRetrying()
+
     # disconnect devices when we are done
     for device in lightshow.devices:
         if device.connected:
@@ -109,6 +143,21 @@ def CountDown(seconds):
             time.sleep(1)
             print(i)
 
+# convert a time string to milliseconds
+# Format: {{[hh]:}[mm]:}[ss]{.[fff]}
+def TimeFromString(time_string : str):
+    parts = time_string.split(':')
+    if len(parts) > 3:
+        raise ValueError("Invalid time: " + time_string)
+    seconds = 0
+    for part in parts:
+        value = float(part)
+        # every part needs to be a finite, non-negative number, eg. 1:-30 is invalid
+        if not 0 <= value < float('inf'):
+            raise ValueError("Invalid time: " + time_string)
+        seconds = seconds * 60 + value
+    return int(seconds * 1000)
+
 # create an alup Serial connection from a string of connection parameters
 # Format: [PORT]{:[Baud]}
 # Default Baud: 115200
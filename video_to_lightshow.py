@@ -4,9 +4,13 @@ import cv2
 import sys
 import os
 import time
+import tempfile
+import glob
+import multiprocessing
+import atexit
 import logging
 import argparse
-from pyalup.Frame import Frame 
+from pyalup.Frame import Frame
 from pyalup.Device import Device
 from pyalup.TcpConnection import TcpConnection
 from pyalup.SerialConnection import SerialConnection
@@ -16,15 +20,22 @@ from enum import IntEnum
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
-from lightshow.lightshow import Lightshow
-from lightshow.arrangement import Arrangement
-from lightshow.postprocessing import Postprocessing
+from lightshow.lightshow import Lightshow, JsonStreamWriter
+from lightshow.arrangement import Arrangement, SamplingMatrix
+from lightshow.postprocessing import Postprocessing, BrightnessRange
+from lightshow.sampler import Sampler, RegionFromString
+from lightshow.palette import PaletteCompression
+from lightshow.spill import SpillBuffer
+from lightshow.live import LivePlayback
+from lightshow.framecache import FrameCache, ResolutionFromString
+from lightshow.profiling import profiler
 from lightshow.util import Convert
 
 """
 
 Simple script turning a mp4 video file into a lightshow JSON which can be used with lightshow.py
-Scales the given video down to one horizontal line of NUM_LED pixels. Only works for a single device.
+Scales the given video down to the resolution of each given arrangement. Every video frame is decoded once
+and sampled for all arrangements, resulting in one light show with one device per arrangement.
 
 """
 logging.basicConfig()
@@ -35,133 +46,464 @@ logger.setLevel(logging.INFO)
 def main():
     parser = argparse.ArgumentParser(prog="Video To Lightshow", description="Convert video files to ALUP light shows which can be played with the light show player", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     # setup arg parser
-    parser.add_argument('video_file', help="Specify a video file to create a lightshow from")
-    parser.add_argument('-n', '--num_leds', default=10, type=int, help="Use a linear arrangement with n LEDs. Ignored if -a | --arrangement is used")   
+    parser.add_argument('video_file', help="Specify a video file to create a lightshow from. With --live, this can also be a named pipe, a stream URL or a camera index")
+    parser.add_argument('-n', '--num_leds', default=10, type=int, help="Use a linear arrangement with n LEDs. Ignored if -a | --arrangement is used")
     parser.add_argument('-o', '--output', default='output.json', help="The output json file to which the light show will be written.")
     parser.add_argument('-v', '--verbose', action='store_true', help="Enable verbose logging")  # on/off flag
     parser.add_argument('--suppress_live_view', action='store_true', help="Disable the live viewing window. Makes conversion a lot faster")
     parser.add_argument('--no_postprocessing', action='store_true', help="Disable postprocessing steps such as Contrast normailization")
-    parser.add_argument('-a','--arrangement', default=None, help="Specify a bitmap file with the positions of the LEDs. The integer color value of each pixel represents the LEDs index. White (0xffffff) pixels are ignored")
+    parser.add_argument('-a','--arrangement', action='append', default=None, help="Specify a bitmap file with the positions of the LEDs. The integer color value of each pixel represents the LEDs index. White (0xffffff) pixels are ignored. Can be given multiple times to convert the video for several devices at once")
+    parser.add_argument('-r', '--region', action='append', default=None, help="Only sample an arrangement from a part of the video. Format: [x],[y],[width],[height] in fractions of the video size, eg: 0,0,0.5,1 for the left half. If used, it has to be given once for each arrangement, in the same order")
+    parser.add_argument('--live', action='store_true', help="Don't create a light show file, but play the video directly on the given devices in real time")
+    parser.add_argument('--batch', default=None, metavar='OUTPUT_DIR', help="Convert every video in the directory or glob pattern given as video_file using a process pool and write the light shows to this directory. Disables the live view")
+    parser.add_argument('-j', '--jobs', default=os.cpu_count(), type=int, help="The number of videos converted in parallel. Only used with --batch")
+    parser.add_argument('--stream', action='store_true', help="Convert with constant memory usage: sampled colors are buffered on disk and the light show is written frame by frame. Use for long videos")
     parser.add_argument('-i', '--interpolation', choices=[i.name for i in  InterpolationMode],default=InterpolationMode.area.name, help="Select an interpolation mode for conversion.")
 
+    parser.add_argument('--sparse', action='store_true', help="Sample each LED from the pixels of its footprint using a precomputed sparse sampling matrix instead of rescaling whole frames. Ignores --interpolation")
+    parser.add_argument('--footprint', default=1.0, type=float, help="The size of the area sampled for each LED relative to one arrangement pixel. Only used with --sparse")
+    parser.add_argument('--kernel', choices=SamplingMatrix.KERNELS, default=SamplingMatrix.KERNELS[0], help="The weighting of the pixels in the footprint of each LED. Only used with --sparse")
+    parser.add_argument('--max_samples', default=64, type=int, help="The maximum number of pixels sampled for each LED. Only used with --sparse")
+
+    parser.add_argument('--palette', default=None, type=int, help="Compress the light show colors using palettes with at most this many colors (1-256). Each LED then only needs one byte per frame")
+    parser.add_argument('--palette_method', choices=PaletteCompression.METHODS, default=PaletteCompression.METHODS[0], help="The quantization method for palettes which need more colors than given by --palette")
+    parser.add_argument('--palette_max_error', default=None, type=float, help="The maximum mean quantization error (RGB distance) per palette. Palettes exceeding it are split into palettes for shorter segments")
+    parser.add_argument('--palette_segment', default=None, type=int, help="Use one palette for each segment of this many frames instead of one global palette")
+
+    parser.add_argument('--cache', default=None, help="Cache the decoded and downscaled video frames in this directory. Converting the same video again (eg. with other arrangements or settings) then skips decoding")
+    parser.add_argument('--cache_resolution', default="320x180", help="The resolution of the cached frames. Format: [width]x[height]. Needs to be at least as large as the arrangements. Only used with --cache")
+    parser.add_argument('--cache_fps', default=None, type=float, help="Resample the cached frames to this frame rate. Default: keep all frames. Only used with --cache")
+    parser.add_argument('--cache_size', default=4096, type=int, help="The maximum size of the cache in MiB. Least recently used videos are evicted. Only used with --cache")
+
+    parser.add_argument('--profile', default=None, help="Measure the time spent in each conversion stage and save it to this file when done. Files ending with .json get a Chrome trace, others a text summary. Use - to print the summary")
+    parser.add_argument('--cprofile', action='store_true', help="Additionally run cProfile. Only used with --profile")
+
     parser.add_argument('--serial', nargs=1, default=None, help="Specify a serial connected ALUP device to add to the light show file Format: [PORT]{:[BAUD]} eg: COM7:115200. Default Baud:115200")
     parser.add_argument('--tcp', nargs=1, default=None, help="Specify a TCP connected ALUP device to add to the light show file. Format: [ip]{:[BAUD]} eg: 127.0.0.1:5012. Default Port: 5012")
+    parser.add_argument('-d', '--device', action='append', default=None, help="Specify an ALUP device for each arrangement, in the same order. Format: serial:[PORT]{:[BAUD]} or tcp:[ip]{:[PORT]} eg: serial:COM7:115200")
 
     # handle cmdline args
     args = parser.parse_args()
 
-    device = Device()
-    if(args.serial is not None):
-        device.connection = SerialConnectionFromString(args.serial[0])
-    elif(args.tcp is not None):
-        device.connection = TcpConnectionFromString(args.tcp[0])
-    else:
-        # don't add device because it is not specified
-        device = None
+    if args.profile is not None:
+        profiler.Enable(args.cprofile)
+        atexit.register(profiler.Save, args.profile)
+
+    try:
+        devices = DevicesFromArgs(args)
+    except ValueError as e:
+        parser.error(str(e))
 
     if(args.verbose):
         logging.basicConfig()
         logging.getLogger().setLevel(logging.DEBUG)
         logger.setLevel(logging.DEBUG)
 
-    # choose interpolation mode 
+    # choose interpolation mode
     interpolation = InterpolationMode[args.interpolation].value
 
 
-    # read in LED arrangement
-    logger.info("Generating arrangement from bitmap " + str(args.arrangement))
-    arrangement = Arrangement()
-    
-    if(args.arrangement is not None):
-        arrangement.FromBitmap(args.arrangement)
-    else:
-        arrangement.Linear(args.num_leds)
-    mask = arrangement.GetMask()
+    # read in LED arrangements
+    arrangements = []
+    for bitmap in (args.arrangement or []):
+        logger.info("Generating arrangement from bitmap " + str(bitmap))
+        arrangement = Arrangement()
+        arrangement.FromBitmap(bitmap)
+        if arrangement.shape is None:
+            parser.error("Could not read arrangement from " + str(bitmap))
+        arrangements.append(arrangement)
 
-    #logger.debug("Mask" + str(mask))  
-    cap = cv2.VideoCapture(args.video_file)
+    if len(arrangements) == 0:
+        arrangement = Arrangement()
+        arrangement.Linear(args.num_leds)
+        arrangements.append(arrangement)
+
+    regions = [None for _ in arrangements]
+    if args.region is not None:
+        if len(args.region) != len(arrangements):
+            parser.error(f"Got {len(args.region)} region(s) for {len(arrangements)} arrangement(s)")
+        try:
+            regions = [RegionFromString(region) for region in args.region]
+        except ValueError as e:
+            parser.error(str(e))
+
+    if len(devices) not in (0, len(arrangements)):
+        parser.error(f"Got {len(devices)} device(s) for {len(arrangements)} arrangement(s)")
+
+    if args.live and len(devices) == 0:
+        parser.error("--live needs a device for each arrangement")
+
+    if args.cache is not None:
+        try:
+            cache_resolution = ResolutionFromString(args.cache_resolution)
+        except ValueError as e:
+            parser.error("Invalid --cache_resolution: " + str(e))
+        # the cached frames (or their regions) need at least one pixel for each arrangement pixel
+        for arrangement, region in zip(arrangements, regions):
+            width, height = cache_resolution
+            if region is not None:
+                width, height = width * region[2], height * region[3]
+            if width < arrangement.shape[0] or height < arrangement.shape[1]:
+                parser.error(f"--cache_resolution {args.cache_resolution} is too small for arrangement {arrangement.name} ({arrangement.shape[0]}x{arrangement.shape[1]})" + ("" if region is None else " in its region"))
+
+    if args.batch is not None and args.live:
+        parser.error("--batch can't be used with --live")
+
+    if args.batch is not None and args.profile is not None:
+        parser.error("--profile only measures the main process and can't be used with --batch")
+
+    if args.stream and args.palette is not None:
+        parser.error("--palette needs all frames at once and can't be used with --stream")
+
+    compression = None
+    if args.palette is not None:
+        try:
+            compression = PaletteCompression(args.palette, args.palette_method, args.palette_max_error, args.palette_segment)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # one sampler for each arrangement/device pair
+    samplers = [Sampler(arrangement, region, interpolation, args.sparse, args.footprint, args.kernel, args.max_samples) for arrangement, region in zip(arrangements, regions)]
+
+    if args.batch is not None:
+        ConvertBatch(args.video_file, args.batch, samplers, args, compression)
+        return
+
+    if args.live:
+        show = Lightshow()
+        show.devices.extend(devices)
+        PlayLive(show, samplers, VideoSourceFromString(args.video_file))
+        return
+
+    ConvertVideo(args.video_file, args.output, samplers, devices, args, compression)
+
+
+# convert a single video file into a light show file
+# @param video_file: the video file to convert
+# @param output: the path of the light show file to write
+# @param samplers: one sampler for each device
+# @param devices: the devices to add to the light show; either empty or one for each sampler
+# @param args: the parsed command line arguments
+# @param compression: the PaletteCompression to use or None
+# @returns: a tuple (number of frames, video duration in ms)
+def ConvertVideo(video_file, output, samplers, devices, args, compression = None):
     show = Lightshow()
 
-    # add the device to the show
-    if device is not None:
-        show.devices.append(device)
-
-    show.frames = [[]] # initialize frames for one device
-
-    logger.info("Converting video...")
-    while cap.isOpened():
-
-
-
-        ret, frame = cap.read()
-        if not ret:
-            logger.info("Video end reached.")
-            break
-        
-        # get the time stamp of the current video frame in ms
-        timestamp = int(cap.get(cv2.CAP_PROP_POS_MSEC))
+    # add the devices to the show
+    show.devices.extend(devices)
 
+    # decode the video or read its frames from the cache
+    if args.cache is not None:
+        cache = FrameCache(args.cache, args.cache_size * 1024**2)
+        video_frames = cache.Frames(video_file, ResolutionFromString(args.cache_resolution), args.cache_fps)
+    else:
+        video_frames = VideoFrames(video_file)
 
-        # rescale frame to the same resolution as the arrangement
-        resized_frame = cv2.resize(frame, arrangement.shape, interpolation=interpolation)
-        resized_frame = cv2.bitwise_and(resized_frame, mask)
+    show.frames = [[] for _ in samplers] # initialize frames for each device
 
-        # sample from the frame based on the LED positions defined in the arrangement
-        colors = SampleFromFrame(resized_frame, arrangement)
+    # when streaming, the colors of each device are buffered on disk and only their brightness range is kept
+    spill_directory = None
+    spills = None
+    if args.stream:
+        spill_directory = tempfile.TemporaryDirectory(prefix="video_to_lightshow_")
+        spills = [SpillBuffer(spill_directory.name, f"device_{i}", len(sampler.arrangement.coordinates)) for i, sampler in enumerate(samplers)]
+        brightness = [BrightnessRange() for _ in samplers]
 
-        # add the colors of this frame to the light show
-        AddFrameToLightshow(show, colors, timestamp)
+    logger.info("Converting video...")
+    n_frames = 0
+    duration = 0
+    for timestamp, frame in video_frames:
+        n_frames += 1
+        duration = timestamp
+        # the frame is decoded once and sampled for every arrangement
+        for i, sampler in enumerate(samplers):
+            # sample from the frame based on the LED positions defined in the arrangement
+            colors = sampler.Sample(frame)
+
+            # add the colors of this frame to the light show
+            if spills is not None:
+                spills[i].Append(timestamp, colors)
+                brightness[i].Update(colors)
+            else:
+                AddFrameToLightshow(show, colors, timestamp, device=i)
+
+            # provide a live view of what's currently processed
+            if not args.suppress_live_view:
+                reresized_frame = cv2.resize(sampler.resized_frame, None, fx=25, fy = 25, interpolation = cv2.INTER_NEAREST)
+                cv2.imshow(f'frame {i}', reresized_frame)
+
+                # show the raw color output for debug purposes
+                if (logger.level <= logging.DEBUG):
+                    cv2.imshow(f"colors {i}", cv2.resize(cv2.cvtColor(np.array([colors]), cv2.COLOR_RGB2BGR), None, fx=25, fy = 25, interpolation = cv2.INTER_NEAREST))
 
-        # provide a live view of what's currently processed
         if not args.suppress_live_view:
-            reresized_frame = cv2.resize(resized_frame, None, fx=25, fy = 25, interpolation = cv2.INTER_NEAREST)
-            cv2.imshow('frame', reresized_frame)
-
-            # show the raw color output for debug purposes
-            if (logger.level <= logging.DEBUG):
-                cv2.imshow("colors", cv2.resize(cv2.cvtColor(np.array([colors]), cv2.COLOR_RGB2BGR), None, fx=25, fy = 25, interpolation = cv2.INTER_NEAREST))
-
             if cv2.waitKey(1) == ord('q'):
                 break
+    else:
+        logger.info("Video end reached.")
+    # stop decoding if the conversion was aborted
+    video_frames.close()
+
+    # don't write an empty light show, eg. for a corrupt video
+    if n_frames == 0:
+        logger.error("No frames could be decoded from " + str(video_file))
+        cv2.destroyAllWindows()
+        if spill_directory is not None:
+            for spill in spills:
+                spill.Close()
+            spill_directory.cleanup()
+        return n_frames, duration
+
+    comments = [f"Converted from '{Path(video_file).name}'"] + ArrangementComments(samplers)
+    comments.append(f"Sparse sampling: footprint {args.footprint}, kernel {args.kernel}" if args.sparse else f"Interpolation: {args.interpolation}")
+
+    if spills is not None:
+        cv2.destroyAllWindows()
+        logger.info("Writing JSON" + ("" if args.no_postprocessing else " with contrast normalization"))
+        with profiler.Stage("encode"):
+            WriteStreamed(show, spills, brightness, output, comments, not args.no_postprocessing)
+        spill_directory.cleanup()
+        logger.info("Done. Saved to " + str(output))
+        return n_frames, duration
 
     if (not args.no_postprocessing):
         logger.info("Doing post processing:")
         logger.info(" - Contrast normalization")
         for frames in show.frames:
-         frames = Postprocessing.NormalizeContrast(frames)
+         with profiler.Stage("postprocess"):
+            frames = Postprocessing.NormalizeContrast(frames)
 
     # show the final result for debug purposes
     if (logger.level <= logging.DEBUG):
         logger.info("Showing final result. Press q to on video to skip")
-        for frame in show.frames[0]:
-            cv2.imshow("Final result", cv2.resize(cv2.cvtColor(np.array([[Convert.intToRGB(color) for color in frame.colors]], dtype=np.uint8), cv2.COLOR_RGB2BGR), None, fx=25, fy = 25, interpolation = cv2.INTER_NEAREST))
+        for frames in zip(*show.frames):
+            for i, frame in enumerate(frames):
+                cv2.imshow(f"Final result {i}", cv2.resize(cv2.cvtColor(np.array([[Convert.intToRGB(color) for color in frame.colors]], dtype=np.uint8), cv2.COLOR_RGB2BGR), None, fx=25, fy = 25, interpolation = cv2.INTER_NEAREST))
             if cv2.waitKey(30) & 0xFF == ord('q'):
                 break
 
 
     # close all cv2 related stuff
-    cap.release()
     cv2.destroyAllWindows()
 
-   
+
 
 
     logger.info("Converting to JSON")
     # export the lightshow as json
-    show.toJson(args.output, comments=[f"Converted from '{Path(args.video_file).name}'", f"Arrangement: {arrangement.name}", f"Interpolation: {args.interpolation}"])
-    logger.info("Done. Saved to " + str(args.output))
-
-
-# sample from a frame using the given arrangement tuples (index, x, y)
-def SampleFromFrame(frame, arrangement):
-    rgb_frame =  cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    colors = [None for _ in range(len(arrangement.coordinates))]
-    for led in arrangement.coordinates:
-        index = led[0]
-        x = led[1]
-        y = led[2]
-        colors[index] = rgb_frame[y][x]
-    return colors
+    with profiler.Stage("encode"):
+        show.toJson(output, comments=comments, compression=compression)
+    if compression is not None:
+        logger.info(compression.Summary())
+    logger.info("Done. Saved to " + str(output))
+    return n_frames, duration
+
+
+# file extensions of videos picked up when converting a directory with --batch
+VIDEO_EXTENSIONS = [".mp4", ".mkv", ".avi", ".mov", ".webm", ".m4v", ".mpg", ".mpeg", ".wmv"]
+
+# find the videos for a batch conversion
+# @param source: a directory containing videos or a glob pattern
+# @returns: a sorted list of video file paths
+def VideosFromString(source : str):
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source) if Path(name).suffix.lower() in VIDEO_EXTENSIONS)
+    return sorted(path for path in glob.glob(source, recursive=True) if os.path.isfile(path))
+
+
+# convert many videos in parallel using a process pool and log a summary
+# The arrangements are only loaded once; the samplers are sent to each worker process when it starts
+# @param source: a directory containing videos or a glob pattern
+# @param output_directory: the directory to write the light shows to
+# @param samplers: one sampler for each device
+# @param args: the parsed command line arguments
+# @param compression: the PaletteCompression to use or None
+def ConvertBatch(source, output_directory, samplers, args, compression = None):
+    videos = VideosFromString(source)
+    if len(videos) == 0:
+        logger.error("No videos found in " + source)
+        return
+    os.makedirs(output_directory, exist_ok=True)
+    # there is nobody to watch the live views of many parallel conversions
+    args.suppress_live_view = True
+    jobs = max(1, min(args.jobs, len(videos)))
+
+    # videos whose light show would overwrite the one of another video are not converted
+    outputs, results = BatchOutputs(videos, output_directory)
+    for result in results:
+        logger.error(f"{result['video']} failed: {result['error']}")
+    tasks = [(video, output) for video, output in outputs.items()]
+
+    logger.info(f"Converting {len(tasks)} videos using {jobs} processes...")
+    t_start = time.perf_counter()
+    with multiprocessing.Pool(jobs, initializer=_InitBatchWorker, initargs=(samplers, args, compression)) as pool:
+        for i, result in enumerate(pool.imap_unordered(_ConvertBatchVideo, tasks)):
+            results.append(result)
+            if result["error"] is None:
+                logger.info(f"[{i + 1}/{len(tasks)}] {result['video']}: {result['frames']} frames in {result['time']:.1f} s" + _CompressionInfo(result))
+            else:
+                logger.error(f"[{i + 1}/{len(tasks)}] {result['video']} failed: {result['error']}")
+    elapsed = time.perf_counter() - t_start
+
+    succeeded = [result for result in results if result["error"] is None]
+    failed = [result for result in results if result["error"] is not None]
+    frames = sum(result["frames"] for result in succeeded)
+    duration = sum(result["duration"] for result in succeeded) / 1000
+    logger.info("Batch conversion summary:")
+    logger.info(f" - Videos: {len(succeeded)} converted, {len(failed)} failed")
+    logger.info(f" - Frames: {frames}, video duration: {duration:.1f} s")
+    logger.info(f" - Wall time: {elapsed:.1f} s, throughput: {frames / elapsed:.1f} frames/s ({duration / elapsed:.2f}x real time)")
+    compressed = [result["compression"] for result in succeeded if result["compression"] is not None]
+    if len(compressed) > 0:
+        raw_bytes = sum(stats["raw_bytes"] for stats in compressed)
+        compressed_bytes = sum(stats["compressed_bytes"] for stats in compressed)
+        # weight the mean error of each video by its number of colors
+        mean_error = sum(stats["mean_error"] * stats["raw_bytes"] for stats in compressed) / max(raw_bytes, 1)
+        logger.info(f" - Palette compression: {raw_bytes} -> {compressed_bytes} bytes (ratio {raw_bytes / max(compressed_bytes, 1):.2f}:1), "
+                    f"quantization error: mean {mean_error:.2f}, max {max(stats['peak_error'] for stats in compressed):.2f}")
+        exceeding = sum(stats["exceeding_segments"] for stats in compressed)
+        if exceeding > 0:
+            logger.warning(f" - {exceeding} palette(s) exceed --palette_max_error even for single frames; use a larger --palette to meet it")
+    for result in failed:
+        logger.info(f" - Failed: {result['video']}: {result['error']}")
+
+
+# choose the light show file of each video of a batch
+# Light shows are named after their video. If several videos have the same name without extension, the extension is kept.
+# @returns: a dict mapping each video to its output file and a list of failed results for videos whose output would collide
+def BatchOutputs(videos, output_directory):
+    stems = {}
+    for video in videos:
+        stems.setdefault(Path(video).stem, []).append(video)
+
+    outputs = {}
+    used = {}
+    failed = []
+    for video in videos:
+        name = Path(video).stem if len(stems[Path(video).stem]) == 1 else Path(video).name
+        output = os.path.join(output_directory, name + ".json")
+        if output in used:
+            failed.append({"video" : video, "output" : output, "frames" : 0, "duration" : 0, "time" : 0.0, "compression" : None,
+                           "error" : f"output {output} is already used for {used[output]}"})
+            continue
+        used[output] = video
+        outputs[video] = output
+    return outputs, failed
+
+# format the compression statistics of a batch result for logging
+def _CompressionInfo(result):
+    stats = result["compression"]
+    if stats is None:
+        return ""
+    ratio = stats["raw_bytes"] / max(stats["compressed_bytes"], 1)
+    exceeding = f", {stats['exceeding_segments']} palette(s) exceed the maximum error" if stats["exceeding_segments"] > 0 else ""
+    return f", compression ratio {ratio:.2f}:1, quantization error: mean {stats['mean_error']:.2f}, max {stats['peak_error']:.2f}" + exceeding
+
+
+# state of a batch worker process; set once by _InitBatchWorker()
+_batch_worker = {}
+
+def _InitBatchWorker(samplers, args, compression):
+    # decode one video per process instead of letting OpenCV spawn threads in every process
+    cv2.setNumThreads(1)
+    # only the main process reports progress
+    logger.setLevel(logging.WARNING)
+    _batch_worker["samplers"] = samplers
+    _batch_worker["args"] = args
+    _batch_worker["compression"] = compression
+    _batch_worker["devices"] = DevicesFromArgs(args)
+
+def _ConvertBatchVideo(task):
+    video_file, output = task
+    result = {"video" : video_file, "output" : output, "frames" : 0, "duration" : 0, "time" : 0.0, "compression" : None, "error" : None}
+    t_start = time.perf_counter()
+    compression = _batch_worker["compression"]
+    try:
+        result["frames"], result["duration"] = ConvertVideo(video_file, output, _batch_worker["samplers"], _batch_worker["devices"], _batch_worker["args"], compression)
+        if result["frames"] == 0:
+            result["error"] = "no frames could be decoded"
+        elif compression is not None:
+            # the worker doesn't log, so the statistics are reported by the main process
+            result["compression"] = {"palettes" : len(compression.palettes), "raw_bytes" : compression.raw_bytes, "compressed_bytes" : compression.compressed_bytes,
+                                     "mean_error" : compression.mean_error, "peak_error" : compression.peak_error, "exceeding_segments" : compression.exceeding_segments}
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        # don't leave a partially written light show in the library
+        if os.path.exists(output):
+            os.remove(output)
+    result["time"] = time.perf_counter() - t_start
+    return result
+
+
+# decode all frames of a video file
+# @param video_file: the path of the video file
+# @returns: a generator yielding a tuple (timestamp in ms, BGR frame) for each frame
+def VideoFrames(video_file):
+    cap = cv2.VideoCapture(video_file)
+    try:
+        while cap.isOpened():
+            with profiler.Stage("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            # get the time stamp of the current video frame in ms
+            yield int(cap.get(cv2.CAP_PROP_POS_MSEC)), frame
+    finally:
+        cap.release()
+
+
+# play a video source directly on the devices of the light show
+# @param show: a light show containing one device for each sampler
+# @param samplers: the samplers for each device
+# @param source: the video source for cv2.VideoCapture
+def PlayLive(show, samplers, source):
+    try:
+        show.Connect()
+        show.Calibrate()
+        LivePlayback(show, samplers, source).Run()
+    except ConnectionError as e:
+        logger.error(str(e))
+    except KeyboardInterrupt:
+        print("CTL + C pressed, stopping.")
+    finally:
+        for device in show.devices:
+            if device.connected:
+                device.Clear()
+                device.Disconnect()
+
+# get the video source for cv2.VideoCapture from a string
+# integers are interpreted as camera index, everything else as file name, pipe or URL
+def VideoSourceFromString(source : str):
+    return int(source) if source.isdigit() else source
+
+# write the buffered frames of each device to a json file one by one
+# @param show: the light show containing the devices
+# @param spills: a SpillBuffer for each device
+# @param brightness: a BrightnessRange for each device
+# @param output: the path of the json file
+# @param comments: comments to add to the json file
+# @param normalize: apply contrast normalization to each frame
+def WriteStreamed(show, spills, brightness, output, comments, normalize = True):
+    with JsonStreamWriter(show, output, comments) as writer:
+        for i, spill in enumerate(spills):
+            for timestamp, colors in spill.Frames():
+                if normalize:
+                    with profiler.Stage("postprocess"):
+                        colors = Postprocessing.NormalizeContrastColors(colors, brightness[i].darkest, brightness[i].brightest)
+                frame = Frame()
+                frame.colors = [Convert.rgbToInt(color) for color in colors.tolist()]
+                frame.timestamp = timestamp
+                writer.Write(frame, device=i)
+
+# describe the arrangement and region of each device for the light show comments
+def ArrangementComments(samplers):
+    comments = []
+    for i, sampler in enumerate(samplers):
+        comment = f"Arrangement (device {i}): {sampler.arrangement.name}"
+        if sampler.region is not None:
+            comment += f", Region: {sampler.region}"
+        comments.append(comment)
+    return comments
 
 # create an alup Serial connection from a string of connection parameters
 # Format: [PORT]{:[Baud]}
@@ -181,19 +523,47 @@ def TcpConnectionFromString(parameters : str):
     port = int(splitted[1]) if len(splitted) > 1 else 5012
     return TcpConnection(ip, port)
 
+# create an alup connection from a string of connection parameters
+# Format: serial:[PORT]{:[Baud]} or tcp:[ip]{:[port]}
+def ConnectionFromString(parameters : str):
+    connection_type, _, connection_parameters = parameters.partition(':')
+    if connection_type == "serial":
+        return SerialConnectionFromString(connection_parameters)
+    elif connection_type == "tcp":
+        return TcpConnectionFromString(connection_parameters)
+    raise ValueError("Unknown connection type '" + connection_type + "' for device " + parameters)
+
+# create the alup devices given by --serial, --tcp and -d | --device
+# raises ValueError for invalid connection parameters
+def DevicesFromArgs(args):
+    devices = []
+    if(args.serial is not None):
+        devices.append(DeviceFromConnection(SerialConnectionFromString(args.serial[0])))
+    elif(args.tcp is not None):
+        devices.append(DeviceFromConnection(TcpConnectionFromString(args.tcp[0])))
+    for parameters in (args.device or []):
+        devices.append(DeviceFromConnection(ConnectionFromString(parameters)))
+    return devices
+
+# create an alup device using the given connection
+def DeviceFromConnection(connection):
+    device = Device()
+    device.connection = connection
+    return device
+
 
 # add a frame with the given colors and the given time stamp
 # to the given lightshow
 # @param lightshow: a lightshow object
-# @param colors: an array of hexadecimal RGB values
+# @param colors: a numpy array of RGB values
 # @param timestamps: the time stamp in ms of the given frame
-def AddFrameToLightshow(lightshow, colors, timestamp):
+# @param device: the index of the device to add the frame to. Default: 0
+def AddFrameToLightshow(lightshow, colors, timestamp, device = 0):
     frame = Frame()
-    frame.colors = [Convert.rgbToInt(color) for color in colors]
+    frame.colors = [Convert.rgbToInt(color) for color in colors.tolist()]
     frame.timestamp = timestamp
 
-    # NOTE: currently, this will only work for one single device
-    lightshow.frames[0].append(frame)
+    lightshow.frames[device].append(frame)
 
 
 
@@ -205,8 +575,8 @@ class InterpolationMode(IntEnum):
 
     def __str__(self):
         return self.value
-    
-    
+
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()